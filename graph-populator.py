@@ -18,13 +18,27 @@
 
 
 
+import collections
 import getopt
+import hashlib
+import imp
 import importlib
+import json
 import logging
-import pprint
+import os
+import re
+import socket
 import sys
-import py2neo
-import neo4j
+import time
+
+# The database drivers are imported by import_database_drivers, only if a database is used.
+# Printing queries, writing scripts and dry runs do not need them.
+py2neo = None
+neo4j = None
+
+# Errors signaling a lost database connection (bolt:// and http:// URLs). Loads interrupted by them can be resumed with --resume.
+# Set by import_database_drivers, the in-memory graph never loses its connection.
+CONNECTION_ERRORS = ()
 
 #########################
 # Class Handling Import #
@@ -32,16 +46,61 @@ import neo4j
 
 class DomainModelCreator:
 
+    #
+    # Creation scripts in the order they are run against the database.
+    # Checkpoints refer to these names, so do not rename them without invalidating old checkpoints.
+    #
+    PHASES = [
+        "create_nodes",
+        "create_relations_subclass",
+        "create_relations_objectproperty",
+        "create_namespaces",
+        "create_property_nodes",
+        "create_req_property_relations",
+        "create_opt_property_relations"
+    ]
+
+    # Batch size each phase starts with, it is tuned while the phase is running
+    INITIAL_BATCH_SIZE = 100
+
+    # Number of rows sent with one UNWIND query, see unwind_rows
+    ROW_BATCH_SIZE = 500
+
+    # Size (in MB) the parameters of one batch may take up, see --batch-memory
+    BATCH_MEMORY = 16
+
+    # Number of queries per statement template run with PROFILE (see --profile-queries)
+    PROFILE_SAMPLE_SIZE = 3
+
     #
     # Establish db-connection
+    # For dry runs an in-memory graph is used instead of the database.
+    # If a load is resumed, the database is neither cleared nor is the constraint created again.
     #
     def setup_db_connection(self):
-        
-        self.neo4j_connection = py2neo.Graph(self.db_url, auth=(self.db_user, self.db_pwd))
-        print_info("Establishing database connection with " + self.db_url + " ... ")
-        self.neo4j_connection.run("MATCH (n) DETACH DELETE n")
-        self.neo4j_connection.run("CREATE CONSTRAINT ON (n:TBox) ASSERT n.identifier IS UNIQUE")
-        print_info("Database cleard")
+        global has_warning
+
+        if self.opt_dry_run:
+            self.neo4j_connection = MemoryGraph()
+            print_info("Dry run: Loading into an in-memory graph instead of a database ... ")
+        else:
+            import_database_drivers()
+            self.neo4j_connection = py2neo.Graph(self.db_url, auth=(self.db_user, self.db_pwd))
+            print_info("Establishing database connection with " + self.db_url + " ... ")
+
+        if self.opt_resume and not self.opt_dry_run:
+            self.resume_checkpoint = self.read_checkpoint()
+
+        if self.resume_checkpoint is None:
+            self.neo4j_connection.run("MATCH (n) DETACH DELETE n")
+            self.neo4j_connection.run("CREATE CONSTRAINT ON (n:TBox) ASSERT n.identifier IS UNIQUE")
+            print_info("Database cleard")
+        else:
+            print_info(("Resuming load in phase '{phase}' after {offset} committed queries " +
+                        "({batch} batches). Database is not cleared.").format(**self.resume_checkpoint))
+            if self.resume_checkpoint.get("has_warning"):
+                has_warning = True
+                print_info("The interrupted load reported warnings, the database will be cleared after the load.")
 
         if self.opt_verbose or self.opt_v_verbose:
             print_info("Connection established ...")
@@ -52,66 +111,425 @@ class DomainModelCreator:
 
     #
     # Helper function deciding what to do with query.
-    # If no db-connection is established, print it to std_out.
-    # If db-connection is established, execute query.
+    # If no db-connection is established, print it to std_out (or the output file, see --output).
+    # If db-connection is established, the query is added to the current batch.
+    # Full batches are committed in one transaction.
+    # Queries already committed by an interrupted run are skipped if the load is resumed.
     # Iheck if any verbose mode is active and print accoriding mesages to std_out.
+    # parameters is an optional dict of the parameters of the query.
     #
-    def execute_query(self, query, verbose_msg):
+    def execute_query(self, query, verbose_msg, parameters=None):
         if self.neo4j_connection is None:
-            print(query)
+            self.write_query(query, parameters, self.output)
         else:
+            self.phase_offset += 1
+            if self.phase_offset <= self.resume_offset:
+                return
+
             if self.opt_verbose:
                 print("// " + verbose_msg)
                 # Question: Should the verbose_msg also be cypher compatible or do I use
-                # this only if I want to see whats happening? 
+                # this only if I want to see whats happening?
             if self.opt_v_verbose:
-                print(query)
-            try: 
-                self.neo4j_connection.run(query)
-            except Exception as e: 
-                print_warning(e)
+                self.write_query(query, parameters, sys.stdout)
+
+            if self.opt_profile_queries:
+                self.query_profile(query)["queries"] += 1
 
+            # batches are committed once they reach the batch size of the phase or --batch-memory
+            self.pending_queries.append((query, parameters))
+            self.pending_bytes += len(query) + estimated_size(parameters)
+            if (len(self.pending_queries) >= self.phase_stats[self.current_phase]["batch_size"] or
+                    self.pending_bytes >= self.max_batch_bytes):
+                self.commit_batch()
 
     #
-    # Import all all python dict files stated as arguments as modules dynamically
-    # Basic validity checks. Exits early and loudly if the imported dicts are faulty!
-    # Returns list of imported modules.
+    # Writes a query to output. Parameters are written as :param commands before the query
+    # (understood by cypher-shell and the Neo4j Browser), the query is then terminated by ';'.
     #
-    def import_data_files(self):
+    def write_query(self, query, parameters, output):
+        if parameters:
+            for name in sorted(parameters):
+                output.write(":param {} => ".format(name))
+                write_cypher_literal(parameters[name], output)
+                output.write("\n")
+            output.write(query + ";\n")
+        else:
+            output.write(query + "\n")
 
-        domain_models = []
+    #
+    # Commits all pending queries as one batch and tunes the batch size of the current phase
+    # from the measured commit latency and the outcome of the batch.
+    # The latency only covers the transactions (see commit_queries), not the checkpoints written to disk.
+    #
+    def commit_batch(self):
+        if not self.pending_queries:
+            return
+
+        queries = self.pending_queries
+        self.pending_queries = []
+        self.pending_bytes = 0
+
+        self.batch_latency = 0.0
+        failed = not self.commit_queries(queries)
+        latency = self.batch_latency
+
+        stats = self.phase_stats[self.current_phase]
+        stats["batches"] += 1
+        stats["queries"] += len(queries)
+        stats["commit_time"] += latency
+        if failed:
+            stats["failed_batches"] += 1
+        self.tune_batch_size(len(queries), latency, failed)
+
+    #
+    # Commits the queries in one transaction and writes a checkpoint afterwards.
+    # If the transaction fails, it is split into halves which are committed on their own,
+    # so a faulty query only affects itself (same as running them without batches).
+    # Lost connections abort the load, the checkpoint allows to resume it.
+    # When profiling (see --profile-queries), the first queries of each statement template are run with PROFILE.
+    # The time from begin to commit (or rollback) is added to batch_latency.
+    # Returns False if the transaction failed.
+    #
+    def commit_queries(self, queries):
+        tx = None
+        profiled = []
+        start = time.time()
+        try:
+            tx = self.neo4j_connection.begin()
+            for query, parameters in queries:
+                profile = self.query_profile(query) if self.opt_profile_queries else None
+                if profile is not None and profile["scheduled"] < self.PROFILE_SAMPLE_SIZE:
+                    profile["scheduled"] += 1
+                    profiled.append((profile, tx.run("PROFILE " + query, parameters)))
+                else:
+                    tx.run(query, parameters)
+            tx.commit()
+
+        except CONNECTION_ERRORS as e:
+            raise LoadInterruptedError(self.checkpoint_file, e)
 
-        for dict_file in self.arguments:
+        except Exception as e:
             try:
-                domain_models.append(importlib.import_module(dict_file[0:-3]))
-            except Exception as exception:
-                print(  "#### ERROR ####: \n" +
-                        "A python dict file can not be imported correctly \n" +
-                        "Exception Message:\n" + str(exception)
-                )
-                sys.exit()
+                if tx is not None:
+                    tx.rollback()
+            except Exception:
+                pass
+            self.batch_latency += time.time() - start
+
+            # The queries are run again, so are their samples
+            for profile, cursor in profiled:
+                profile["scheduled"] -= 1
 
-        # Checks if imported files contain at least a dict called "classes"
-        # Checks if other attributs called "relations" or "namespaces" are availabed and if so dicts 
-        # Expected import order is rootclass dict first
-        for i, domain_model in enumerate(domain_models):
-            if hasattr(domain_model, "classes"):
-                if not type(domain_model.classes) is list:
-                    raise NoListError(domain_model.__name__, "classes")
+            if len(queries) == 1:
+                print_warning(e)
+                self.committed_offset += 1
+                self.write_checkpoint(False)
             else:
-                raise NoClassesListError(domain_model.__name__)
+                middle = len(queries) // 2
+                self.commit_queries(queries[:middle])
+                self.commit_queries(queries[middle:])
+            return False
+        self.batch_latency += time.time() - start
 
-            if hasattr(domain_model, "relations"):
-                if not type(domain_model.relations) is list:
-                    raise NoListError(domain_model.__name__, "relations")
+        for profile, cursor in profiled:
+            self.add_plan(profile, cursor)
+
+        self.committed_offset += len(queries)
+        self.batch_index += 1
+        self.write_checkpoint(False)
+        return True
+
+    #
+    # Returns the profile of the statement template of the query in the current phase (see query_template).
+    #
+    def query_profile(self, query):
+        key = (self.current_phase, query_template(query))
+        if key not in self.query_profiles:
+            self.query_profiles[key] = {
+                "queries": 0,
+                "scheduled": 0,
+                "profiled": 0,
+                "db_hits": 0,
+                "rows": 0,
+                "operators": collections.OrderedDict()
+            }
+        return self.query_profiles[key]
+
+    #
+    # Adds the plan of a query run with PROFILE to the profile of its statement template.
+    # Plans are read from the summary of the cursor (neo4j driver) or from its plan (py2neo).
+    # Backends without plans, like the in-memory graph, only count the query.
+    #
+    def add_plan(self, profile, cursor):
+        plan = None
+        try:
+            if hasattr(cursor, "summary"):
+                plan = getattr(cursor.summary(), "profile", None)
+            if plan is None and hasattr(cursor, "plan"):
+                plan = cursor.plan()
+        except Exception as e:
+            if self.opt_v_verbose:
+                print("// Could not read query plan: " + str(e))
+
+        profile["profiled"] += 1
+        if plan is None:
+            return
+
+        operators = plan_operators(plan)
+        if operators:
+            profile["rows"] += operators[0][2]
+        for operator, db_hits, rows in operators:
+            profile["db_hits"] += db_hits
+            profile["operators"][operator] = profile["operators"].get(operator, 0) + 1
+
+    #
+    # Prints db hits, rows and operators of the profiled statement templates per phase.
+    # Flags templates that look up nodes by a key property but were planned with a scan instead of an index seek.
+    #
+    def print_query_profiles(self):
+        print_info("Query profiles per statement template (PROFILE of up to {} queries each):".format(self.PROFILE_SAMPLE_SIZE))
+        for phase in self.PHASES:
+            for (profile_phase, template), profile in self.query_profiles.items():
+                if profile_phase != phase:
+                    continue
+                print("// [{}] {}".format(phase, template))
+                if not profile["operators"]:
+                    print("//     queries: {}, profiled: {}, no query plans available".format(profile["queries"], profile["profiled"]))
+                    continue
+                print("//     queries: {}, profiled: {}, db hits per query: {:.1f}, rows per query: {:.1f}".format(
+                    profile["queries"], profile["profiled"],
+                    float(profile["db_hits"]) / profile["profiled"], float(profile["rows"]) / profile["profiled"]))
+                print("//     operators: " + ", ".join(profile["operators"]))
+                scans = [operator for operator in profile["operators"] if operator in ["NodeByLabelScan", "AllNodesScan"]]
+                if scans and KEY_LOOKUP.search(template):
+                    print("//     !!! {} where an index seek was expected. Is there an index on the matched property?".format(
+                        " and ".join(scans)))
+
+    #
+    # Adapts the batch size of the current phase within the configured bounds:
+    # Failed batches halve the size, batches slower than the target latency shrink it proportionally
+    # and batches well below the target latency double it, unless batches failed recently.
+    # Partial batches (end of a phase) that went through are not used for tuning.
+    #
+    def tune_batch_size(self, size, latency, failed):
+        stats = self.phase_stats[self.current_phase]
+        batch_size = stats["batch_size"]
+
+        stats["error_rate"] = 0.8 * stats["error_rate"] + (0.2 if failed else 0.0)
+
+        if failed:
+            batch_size = batch_size // 2
+        elif size < batch_size:
+            return
+        elif latency > self.commit_latency:
+            batch_size = int(batch_size * self.commit_latency / latency)
+        elif latency < self.commit_latency / 2 and stats["error_rate"] < 0.05:
+            batch_size = batch_size * 2
+
+        stats["batch_size"] = max(self.batch_size_min, min(self.batch_size_max, batch_size))
+
+        if self.opt_v_verbose:
+            print("// Batch of {} queries committed in {:.3f}s{}. Next batch size: {}".format(
+                size, latency, " (failed)" if failed else "", stats["batch_size"]))
+
+    #
+    # Prints the client-side timings of all phases run against the database
+    #
+    def print_timings(self):
+        print_info("Client-side timings per phase:")
+        print("// {:<35} {:>8} {:>8} {:>7} {:>12} {:>11}".format(
+            "phase", "queries", "batches", "failed", "commit [s]", "batch size"))
+        for phase in self.PHASES:
+            if phase not in self.phase_stats:
+                continue
+            stats = self.phase_stats[phase]
+            print("// {:<35} {:>8} {:>8} {:>7} {:>12.3f} {:>11}".format(
+                phase, stats["queries"], stats["batches"], stats["failed_batches"],
+                stats["commit_time"], stats["batch_size"]))
+
+    #
+    # Runs all creation scripts (see PHASES) against the database.
+    # Writes a checkpoint after each committed batch and after each finished phase.
+    # When resuming, finished phases are skipped and the interrupted phase continues after its last committed batch.
+    #
+    def run_phases(self, domain_models):
+        resume_phase = None
+        if self.resume_checkpoint is not None:
+            resume_phase = self.resume_checkpoint["phase"]
+
+        for phase in self.PHASES:
+            self.current_phase = phase
+            self.phase_offset = 0
+            self.resume_offset = 0
+            self.committed_offset = 0
+            self.batch_index = 0
+
+            if resume_phase is not None:
+                if phase != resume_phase:
+                    print_info("Skipping phase '{}', it was finished before.".format(phase))
+                    continue
+                resume_phase = None
+                if self.resume_checkpoint["complete"]:
+                    print_info("Skipping phase '{}', it was finished before.".format(phase))
+                    continue
+                self.resume_offset = self.resume_checkpoint["offset"]
+                self.committed_offset = self.resume_checkpoint["offset"]
+                self.batch_index = self.resume_checkpoint["batch"]
+
+            self.phase_stats[phase] = {
+                "batch_size": max(self.batch_size_min, min(self.batch_size_max, self.INITIAL_BATCH_SIZE)),
+                "batches": 0,
+                "failed_batches": 0,
+                "queries": 0,
+                "commit_time": 0.0,
+                "error_rate": 0.0
+            }
+
+            getattr(self, phase)(domain_models)
+            self.commit_batch()
+            self.write_checkpoint(True)
+
+        if self.opt_verbose or self.opt_v_verbose or self.opt_profile_queries:
+            self.print_timings()
+        if self.opt_profile_queries:
+            self.print_query_profiles()
+
+    #
+    # Prints the number of nodes per label and relations per relation type of the in-memory graph of a dry run
+    #
+    def print_graph_summary(self):
+        node_counts, relation_counts = self.neo4j_connection.counts()
+        print_info("Dry run finished. The in-memory graph contains:")
+        for label in sorted(node_counts):
+            print("// {:>8} nodes with label '{}'".format(node_counts[label], label))
+        for relation in sorted(relation_counts):
+            print("// {:>8} relations of type '{}'".format(relation_counts[relation], relation))
+
+    #
+    # Computes a hash of the imported domain models.
+    # A checkpoint is only used for resuming if it was written for the same input.
+    # The dicts are serialized as JSON with sorted keys (values JSON does not know by their repr), which is fast for large models.
+    #
+    def hash_domain_models(self, domain_models):
+        model_hash = hashlib.sha1()
+        for domain_model in domain_models:
+            model_hash.update(domain_model.__name__.encode("utf-8"))
+            for dict_name in ["classes", "relations", "namespaces", "properties"]:
+                if hasattr(domain_model, dict_name):
+                    model_hash.update(dict_name.encode("utf-8"))
+                    model_hash.update(json.dumps(getattr(domain_model, dict_name), sort_keys=True, default=repr).encode("utf-8"))
+        return model_hash.hexdigest()
+
+    #
+    # Writes the checkpoint durably: written to a temporary file, flushed to disk and then renamed.
+    # So an interruption while writing leaves the previous checkpoint intact.
+    #
+    def write_checkpoint(self, complete):
+        # An in-memory graph can not be resumed
+        if self.opt_dry_run:
+            return
+
+        checkpoint = {
+            "phase": self.current_phase,
+            "batch": self.batch_index,
+            "offset": self.committed_offset,
+            "complete": complete,
+            "model_hash": self.model_hash,
+            # warnings of the phases a resumed load skips still have to clear the database
+            "has_warning": has_warning,
+            # the offset counts UNWIND queries, whose rows depend on these bounds, see unwind_rows
+            "row_batch_size": self.ROW_BATCH_SIZE,
+            "max_batch_bytes": self.max_batch_bytes
+        }
+        temp_file_name = self.checkpoint_file + ".tmp"
+        with open(temp_file_name, "w") as temp_file:
+            json.dump(checkpoint, temp_file)
+            temp_file.flush()
+            os.fsync(temp_file.fileno())
+        try:
+            os.rename(temp_file_name, self.checkpoint_file)
+        except OSError:
+            # Windows does not replace existing files when renaming
+            os.remove(self.checkpoint_file)
+            os.rename(temp_file_name, self.checkpoint_file)
+
+    #
+    # Reads the checkpoint of an interrupted load.
+    # Returns None if there is no usable checkpoint, the load then starts from scratch.
+    # Refuses to resume if the rows were split into queries differently (see unwind_rows),
+    # the offset of the checkpoint would then skip other rows.
+    #
+    def read_checkpoint(self):
+        try:
+            with open(self.checkpoint_file) as checkpoint_file:
+                checkpoint = json.load(checkpoint_file)
+        except (IOError, ValueError):
+            print_info("No checkpoint found in '{}'. Starting a full load.".format(self.checkpoint_file))
+            return None
+
+        if checkpoint.get("model_hash") != self.model_hash:
+            print_info("The domain models changed since the checkpoint was written. Starting a full load.")
+            return None
+
+        if checkpoint.get("phase") not in self.PHASES:
+            print_info("The checkpoint refers to an unknown phase. Starting a full load.")
+            return None
+
+        if (checkpoint.get("row_batch_size") != self.ROW_BATCH_SIZE or
+                checkpoint.get("max_batch_bytes") != self.max_batch_bytes):
+            raise CheckpointMismatchError(self.checkpoint_file, checkpoint)
+
+        return checkpoint
+
+    #
+    # Removes the checkpoint once it can not be resumed anymore (load finished or database cleared).
+    #
+    def remove_checkpoint(self):
+        if not self.opt_dry_run and os.path.exists(self.checkpoint_file):
+            os.remove(self.checkpoint_file)
 
-            if hasattr(domain_model, "namespaces"):
-                if not type(domain_model.namespaces) is list:
-                    raise NoListError(
-                        domain_model.__name__, "namespaces")
-            # Rootclass needs namespaces dictornary
-            elif not hasattr(domain_model, "namespaces") and i == 0:
-                raise UpperMostLevelError(domain_model.__name__, "namespaces")
+
+    #
+    # Import all all python dict files stated as arguments as modules dynamically
+    # Basic validity checks. Exits early and loudly if the imported dicts are faulty!
+    # Several files are parsed and validated in parallel by a pool of processes (see --jobs).
+    # dict_files defaults to the arguments, the files of an old domain model can be stated for migrations.
+    # Returns list of normalized domain models in the order of the arguments.
+    #
+    def import_data_files(self, dict_files=None):
+        if dict_files is None:
+            dict_files = self.arguments
+
+        jobs = 1
+        if len(dict_files) > 1 and self.jobs != 1:
+            # Only imported if there is something to parse in parallel
+            import multiprocessing
+            jobs = min(self.jobs or multiprocessing.cpu_count(), len(dict_files))
+
+        if jobs > 1:
+            pool = multiprocessing.Pool(processes=jobs)
+            try:
+                parsed_models = pool.map(parse_domain_model, list(enumerate(dict_files)))
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            parsed_models = [parse_domain_model(argument) for argument in enumerate(dict_files)]
+
+        # Errors are reported in the order of the arguments, the first faulty file exits the script
+        domain_models = []
+        for parsed_model in parsed_models:
+            if parsed_model["error"] is not None:
+                error_name, error_args = parsed_model["error"]
+                if error_name == "ImportError":
+                    print(  "#### ERROR ####: \n" +
+                            "A python dict file can not be imported correctly \n" +
+                            "Exception Message:\n" + error_args[0]
+                    )
+                    sys.exit()
+                raise IMPORT_ERRORS[error_name](*error_args)
+            domain_models.append(DomainModel(parsed_model))
 
         return domain_models
 
@@ -119,8 +537,15 @@ class DomainModelCreator:
     # Creats node creation queries.
     # Dynamically take all properties stated for each node in the dicts.
     # Required properties: "label", "title".
+    # The properties are sent as typed parameters, the nodes of a label in batches, see unwind_rows.
+    # Nodes are merged on their identifier, so a batch replayed by a resumed load does not violate the constraint.
+    # Entries reusing an identifier are reported and skipped, see claim_merge_key.
     #
     def create_nodes(self, domain_models):
+        # nodes per label, labels can not be parameters
+        nodes_per_label = collections.OrderedDict()
+        merge_keys = {}
+
         # Iterate over all keys ("title" of the nodes) in all "classes"-dicts stored in the imported dicts
         for domain_model in domain_models:
             temp_classes_dict={}
@@ -132,28 +557,12 @@ class DomainModelCreator:
                 # KeyError is raised when a requested key (property) is missing.
                 # This is the case if there is no "label"-property
                 try:
-                    query_data= {
-                        "label": temp_classes_dict[node]["label"],
-                        "identifier": temp_classes_dict[node]["identifier"],
-                        "title": node
-                    }
-                    query = "CREATE(:{label} {{ title: '{title}', identifier: '{identifier}'".format(**query_data)                    
-
-                    for prop in temp_classes_dict[node]:
-                        # Omitting "label" property as it is required and handeled always outside of this for loop
-                        if prop not in ["label", "identifier", "subclass_of", "required_property", "optional_property"]: # the required properties are omitted, also the ones that will be relations
-                            property_data = {
-                                    "property_name": str(prop),
-                                    "property_value": str(temp_classes_dict[node][prop])
-                            }
-                            # Properties that are not lists are interpreted as stirngs 
-                            if type(temp_classes_dict[node][prop]) is list:
-                                query = query + ", {property_name}:{property_value}".format(**property_data)
-                            else:
-                                query = query + ", {property_name}:'{property_value}'".format(**property_data)
-
-                    query = query + "})"
-                    node= self.execute_query(query, "Creating node: " + node)
+                    for key in ["label", "identifier"]:
+                        if key not in temp_classes_dict[node]: raise KeyError(key)
+                    entry = temp_classes_dict[node]
+                    if self.claim_merge_key(merge_keys, (entry["label"], "identifier", entry["identifier"]),
+                                            "node", node, domain_model.__name__):
+                        nodes_per_label.setdefault(entry["label"], []).append((node, entry))
 
                 except KeyError as missing_key:
                     warning_data = {
@@ -167,6 +576,10 @@ class DomainModelCreator:
                                     "No node '{node}' can be created! \n").format(**warning_data)
                     print_warning(warning_msg)
 
+        for label, nodes in nodes_per_label.items():
+            query = "UNWIND $rows AS row\nMERGE (node:`{}` {{ identifier: row.identifier }})\nSET node = row".format(label)
+            rows = (class_node_properties(node, entry) for node, entry in nodes)
+            self.unwind_rows(query, rows, "Creating {} nodes with label " + label + ", starting with {}")
 
         if self.opt_verbose or self.opt_v_verbose:
             print_info("Node creation finished!")
@@ -174,8 +587,12 @@ class DomainModelCreator:
     #
     # Creates relation creation queries for subclass relations.
     # Nodes need to have a "subclass_of" property in order to be considered.
+    # Relations stated more than once (also across domain models) are merged once, see merge_relations.
     #
     def create_relations_subclass(self, domain_models):
+        # edge-set index keyed by (source, relation type, target), in the order the relations are stated
+        edges = collections.OrderedDict()
+
         for domain_model in domain_models:
             temp_classes_dict={}
             # for node in domain_model.classes:
@@ -197,49 +614,11 @@ class DomainModelCreator:
                     if data_type is list:
                         #iterate over all "parents" of this node in the list
                         for parent in temp_classes_dict[node]["subclass_of"]:
-                            query_data = {
-                                "node_lower": node.lower(),
-                                "node": node,
-                                "parent_lower": parent.lower(),
-                                "parent": parent
-                            }
-
-                            # Create "MATCH" statement
-                            query_match = (
-                                "MATCH ({node_lower}:TBox  {{ title: '{node}' }}), ({parent_lower}:TBox {{ title: '{parent}' }})"
-                            ).format(**query_data)
-
-                            # Create "CREATE" statement
-                            query_create = (
-                                "CREATE ({node_lower})-[:subclass_of]->({parent_lower})"
-                            ).format(**query_data)
-
-                            # Connect "MACTH" and "CREATE" statements
-                            query = query_match + " \n " + query_create + "\n"
-                            self.execute_query(query, "Creating subclass relation from {node} to {parent}".format(node = node, parent = parent))
+                            edges[(node, "subclass_of", parent)] = True
 
                     elif data_type is str:
                         parent = temp_classes_dict[node]["subclass_of"]
-                        query_data = {
-                                "node_lower": node.lower(),
-                                "node": node,
-                                "parent_lower": parent.lower(),
-                                "parent": parent
-                        }
-
-                        # Create "MATCH" statement
-                        query_match = ( 
-                                "MATCH ({node_lower}:TBox  {{ title: '{node}' }}), ({parent_lower}:TBox {{ title: '{parent}' }})"
-                        ).format(**query_data)
-
-                        # Create "CREATE" statement
-                        query_create = (
-                                "CREATE ({node_lower})-[:subclass_of]->({parent_lower})"
-                        ).format(**query_data)
-
-                        # Connect "MACTH" and "CREATE" statements
-                        query = query_match + " \n " + query_create + "\n"
-                        self.execute_query(query, "Creating subclass relation from {node} to {parent}".format(**query_data))
+                        edges[(node, "subclass_of", parent)] = True
 
                     else:
                         warning_msg = ("The 'subclass_of' property of '{node}' in the module '{domain_model}' is neither a list nor a string." +
@@ -253,24 +632,90 @@ class DomainModelCreator:
                                 "is part of the rootclass.").format(**error_data)
                     print_info(info_msg)
 
-            
-              
+        self.merge_relations(edges)
 
         if self.opt_verbose or self.opt_v_verbose:
             print_info("Subclass relation creation finished!")
 
+    #
+    # Creates relation queries for the relations in the edge-set index edges, keyed by (source, relation type, target).
+    # Relations of a type are sent in batches with one UNWIND query (see unwind_rows),
+    # MERGE makes them idempotent, so reruns and resumed loads do not duplicate relations.
+    #
+    def merge_relations(self, edges):
+        rows_per_type = collections.OrderedDict()
+        for source, relation_type, target in edges:
+            rows_per_type.setdefault(relation_type, []).append({"source": source, "target": target})
+
+        for relation_type, rows in rows_per_type.items():
+            query = ("UNWIND $rows AS row\n" +
+                     "MATCH (source:TBox {{ title: row.source }}), (target:TBox {{ title: row.target }})\n" +
+                     "MERGE (source)-[:`{}`]->(target)").format(relation_type)
+            self.unwind_rows(query, rows, "Merging {} " + relation_type + " relations, starting with {}")
+
+    #
+    # Sends the rows (dicts of typed values) with the UNWIND query, which refers to them as $rows.
+    # A batch holds at most ROW_BATCH_SIZE rows and, unless a single row is larger, at most --batch-memory
+    # (estimated size of the rows), so a class with thousands of properties or long values can not blow up the loader.
+    # rows may be a generator, only the rows of the current batch are built then.
+    # verbose_msg is formatted with the number of rows and the title (or source) of the first row of a batch.
+    #
+    def unwind_rows(self, query, rows, verbose_msg):
+        batch = []
+        batch_bytes = 0
+        for row in rows:
+            row_bytes = estimated_size(row)
+            if batch and (len(batch) >= self.ROW_BATCH_SIZE or batch_bytes + row_bytes > self.max_batch_bytes):
+                self.execute_query(query, verbose_msg.format(len(batch), batch[0].get("title", batch[0].get("source"))),
+                                   {"rows": batch})
+                batch = []
+                batch_bytes = 0
+            batch.append(row)
+            batch_bytes += row_bytes
+
+        if batch:
+            self.execute_query(query, verbose_msg.format(len(batch), batch[0].get("title", batch[0].get("source"))),
+                               {"rows": batch})
+
+    #
+    # Remembers the merge key of an entry in merge_keys, a tuple ending with the key property and its value.
+    # The creation queries merge entries with the same key into one, where the constraint used to reject them,
+    # so such entries are reported as warnings and skipped instead. Returns False if the key is already taken.
+    #
+    def claim_merge_key(self, merge_keys, merge_key, kind, name, domain_model_name):
+        if merge_key in merge_keys:
+            warning_data = {
+                "kind": kind,
+                "name": name,
+                "domain_model": domain_model_name,
+                "key_property": merge_key[-2],
+                "value": merge_key[-1],
+                "other": merge_keys[merge_key]
+            }
+            print_warning(("The {kind} '{name}' in the module '{domain_model}' has the same {key_property} '{value}' " +
+                           "as the {kind} '{other}'. No {kind} '{name}' can be created!").format(**warning_data))
+            return False
+        merge_keys[merge_key] = name
+        return True
+
     #
     # Creats relation creation queries for object_property relations.
     # Relations need to have a label", "from_entity", "to_entity" and "namespace" property
+    # The properties are sent as typed parameters, the relations of a type in batches, see unwind_rows.
+    # Relations are merged on their identifier, so a batch replayed by a resumed load does not duplicate them.
+    # Entries reusing an identifier between the same nodes are reported and skipped, see claim_merge_key.
     #
     def create_relations_objectproperty(self, domain_models):
+        # relations per type, types can not be parameters
+        relations_per_type = collections.OrderedDict()
+        merge_keys = {}
 
         for domain_model in domain_models:
             # Check if currently handeled module has a dict called "relations"
             # if not skip this module and display warning
             if hasattr(domain_model, "relations"):
                 temp_relations_dict={}
-                # Iterate each relation in relations dict to dynamically create all relation querries with its properties
+                # Iterate each relation in relations dict to collect all relations with its properties
                 # KeyError is raised when a requested (required) key is missing.
                 # for relation in domain_model.relations:
                 for item in domain_model.relations:
@@ -278,41 +723,12 @@ class DomainModelCreator:
                     temp_relations_dict.update(item)
 
                     try:
-                        # Create "MATCH" statement, needed to identify the starting and ending nodes
-                        query_data = {
-                            "from_lower": temp_relations_dict[relation]["from_entity"].lower(),
-                            "from": temp_relations_dict[relation]["from_entity"],
-                            "to_lower": temp_relations_dict[relation]["to_entity"].lower(),
-                            "to": temp_relations_dict[relation]["to_entity"],
-                            # "title": temp_relations_dict[relation]["namespace"] + ":" + relation,
-                            "title": relation,
-                            "namespace": temp_relations_dict[relation]["namespace"],
-                            "label": temp_relations_dict[relation]["label"],
-                            "identifier": temp_relations_dict[relation]["identifier"]
-                        }
-                        query_match = ("MATCH ({from_lower}:TBox  {{ title: '{from}' }}), ({to_lower}:TBox {{ title: '{to}' }})").format(**query_data)
-
-                        # Create "CREATE" statement for relation
-                        query_create = ("CREATE ({from_lower})-[:{label} {{ title: '{title}', namespace: '{namespace}', identifier: '{identifier}'").format(**query_data)
-                        # Iterating over all properties of this relation to add them dynamically
-                        for prop in temp_relations_dict[relation]:
-                            if prop not in ["label", "from_entity", "namespace", "to_entity", "identifier"]: #the required properties are ommited
-                                property_data = {
-                                    "property_name": str(prop),
-                                    "property_value": str(temp_relations_dict[relation][prop])
-                                }
-                                # Properties that are not lists are interpreted as stirngs 
-                                if type(temp_relations_dict[relation][prop]) is list:
-                                    query_create = query_create + ", {property_name}:{property_value}".format(**property_data)
-                                else:
-                                    query_create = query_create + ", {property_name}:'{property_value}'".format(**property_data)
-                            else:
-                                pass
-                        query_create = query_create + "}}]->({to_lower})".format(**query_data)
-
-                        # connect "MATCH" and "CREATE" statements
-                        query = query_match + "\n " + query_create + "\n"
-                        self.execute_query(query, "Creating object-property-relation '{title}' from {from} to {to}".format(**query_data))
+                        entry = temp_relations_dict[relation]
+                        for key in ["from_entity", "to_entity", "namespace", "label", "identifier"]:
+                            if key not in entry: raise KeyError(key)
+                        merge_key = (entry["label"], entry["from_entity"], entry["to_entity"], "identifier", entry["identifier"])
+                        if self.claim_merge_key(merge_keys, merge_key, "relation", relation, domain_model.__name__):
+                            relations_per_type.setdefault(entry["label"], []).append((relation, entry))
 
                     except KeyError as missing_key:
                         error_data = {
@@ -330,7 +746,15 @@ class DomainModelCreator:
                 info_msg = ("No dict called 'relations' available in module {} No relations created from this domain-model."+
                             "You can safely ignore this, if this is intended.").format(domain_model.__name__)
                 print_info(info_msg)
-               
+
+        for relation_type, relations in relations_per_type.items():
+            query = ("UNWIND $rows AS row\n" +
+                     "MATCH (source:TBox {{ title: row.source }}), (target:TBox {{ title: row.target }})\n" +
+                     "MERGE (source)-[relation:`{}` {{ identifier: row.identifier }}]->(target)\n" +
+                     "SET relation = row.properties").format(relation_type)
+            rows = ({"source": entry["from_entity"], "target": entry["to_entity"], "identifier": entry["identifier"],
+                     "properties": relation_properties(relation, entry)} for relation, entry in relations)
+            self.unwind_rows(query, rows, "Creating {} object-property-relations of type " + relation_type + ", starting from {}")
 
         if self.opt_verbose or self.opt_v_verbose:
             print_info("Object_property relations created!")
@@ -340,8 +764,15 @@ class DomainModelCreator:
     # And create relations between the provided node and the property nodes (the relation will have :TBox l)
     # props is a dict with two keys ("required_properties" & "optional_properties")
     # The values in props is are lists of qualified names
+    # The properties are sent as typed parameters, the nodes of a label pair in batches, see unwind_rows.
+    # Nodes are merged on their identifier (or title if there is none), so resumed loads can replay a batch.
+    # Entries reusing an identifier (or title) are reported and skipped, see claim_merge_key.
     #
     def create_property_nodes(self, domain_models):
+        # nodes per (label, label2, key property), labels can not be parameters
+        nodes_per_labels = collections.OrderedDict()
+        merge_keys = {}
+
         # Iterate over all keys ("title" of the nodes) in all "properties"-dicts stored in the imported dicts
         for domain_model in domain_models:
             if hasattr(domain_model, "properties"):
@@ -353,29 +784,11 @@ class DomainModelCreator:
                     # KeyError is raised when a requested key (property) is missing.
                     # This is the case if there is no "label"-property
                     try:
-                        query_data= {
-                            "label": temp_properties_dict[node]["label"],
-                            "label_2": temp_properties_dict[node]["label2"],
-                            #"identifier": temp_properties_dict[node]["identifier"],
-                            "title": node
-                        }
-                        query = "CREATE(:{label}:{label_2} {{ title: '{title}'".format(**query_data)                    
-
-                        for prop in temp_properties_dict[node]:
-                            # Omitting "label" property as it is required and handeled always outside of this for loop
-                            if prop not in ["label", "label2"]: # the required properties are omitted
-                                property_data = {
-                                        "property_name": str(prop),
-                                        "property_value": str(temp_properties_dict[node][prop])
-                                }
-                                # Properties that are not lists are interpreted as stirngs 
-                                if type(temp_properties_dict[node][prop]) is list:
-                                    query = query + ", {property_name}:{property_value}".format(**property_data)
-                                else:
-                                    query = query + ", {property_name}:'{property_value}'".format(**property_data)
-                        
-                        query = query + "})"
-                        node= self.execute_query(query, "Creating property node: " + node)
+                        key_property = "identifier" if "identifier" in temp_properties_dict[node] else "title"
+                        labels = (temp_properties_dict[node]["label"], temp_properties_dict[node]["label2"], key_property)
+                        merge_key = labels + (temp_properties_dict[node].get(key_property, node),)
+                        if self.claim_merge_key(merge_keys, merge_key, "property node", node, domain_model.__name__):
+                            nodes_per_labels.setdefault(labels, []).append((node, temp_properties_dict[node]))
                     except KeyError as missing_key:
                         warning_data = {
                             "domain_model": domain_model.__name__, 
@@ -388,6 +801,11 @@ class DomainModelCreator:
                                         "No node '{node}' can be created! \n").format(**warning_data)
                         print_warning(warning_msg)
 
+        for (label, label2, key_property), nodes in nodes_per_labels.items():
+            query = "UNWIND $rows AS row\nMERGE (node:`{0}`:`{1}` {{ {2}: row.{2} }})\nSET node = row".format(label, label2, key_property)
+            rows = (property_node_properties(node, entry) for node, entry in nodes)
+            self.unwind_rows(query, rows, "Creating {} property nodes with labels " + label + ":" + label2 + ", starting with {}")
+
         if self.opt_verbose or self.opt_v_verbose:
             print_info("Property Node creation finished!")
 
@@ -402,8 +820,12 @@ class DomainModelCreator:
     # Creates relation creation queries for "optional_property" and "required_property" relations.
     # Nodes need to have a "optional_property" and "required_property" property in order to be considered.
     # relation parameter will be one of ["optional_property" , "required_property"]
+    # Relations stated more than once (also across domain models) are merged once, see merge_relations.
     #
     def _create_property_relations(self, domain_models, relation):
+        # edge-set index keyed by (source, relation type, target), in the order the relations are stated
+        edges = collections.OrderedDict()
+
         for domain_model in domain_models:
             temp_classes_dict={}
             # for node in domain_model.classes:
@@ -425,50 +847,10 @@ class DomainModelCreator:
                     if data_type is list:
                         #iterate over all "relation" of this node in the list
                         for prop in temp_classes_dict[node][relation]:
-                            query_data = {
-                                "node_lower": node.lower(),
-                                "node": node,
-                                "prop_lower": prop.lower(),
-                                "prop": prop,
-                                "prop_typ": relation
-                            }
-
-
-                            # Create "MATCH" statement
-                            query_match = (
-                                "MATCH ({node_lower}:TBox  {{ title: '{node}' }}), ({prop_lower}:TBox {{ title: '{prop}' }})"
-                            ).format(**query_data)
-
-                            # Create "CREATE" statement
-                            query_create = (
-                                "CREATE ({node_lower})-[:{prop_typ}]->({prop_lower})"
-                            ).format(**query_data)
-                            # Connect "MACTH" and "CREATE" statements
-                            query = query_match + " \n " + query_create + "\n"
-                            self.execute_query(query, "Creating property relation from {node} to {prop}".format(node = node, prop = prop))
+                            edges[(node, relation, prop)] = True
                     elif data_type is str:
                         prop = temp_classes_dict[node][relation]
-                        query_data = {
-                                "node_lower": node.lower(),
-                                "node": node,
-                                "prop_lower": prop.lower(),
-                                "prop": prop,
-                                "prop_typ": relation
-                        }
-
-                        # Create "MATCH" statement
-                        query_match = ( 
-                                "MATCH ({node_lower}:TBox  {{ title: '{node}' }}), ({prop_lower}:TBox {{ title: '{prop}' }})"
-                        ).format(**query_data)
-
-                        # Create "CREATE" statement
-                        query_create = (
-                                "CREATE ({node_lower})-[:{prop_typ}]->({parent_lower})"
-                        ).format(**query_data)
-                        
-                        # Connect "MACTH" and "CREATE" statements
-                        query = query_match + " \n " + query_create + "\n"
-                        self.execute_query(query, "Creating property relation from {node} to {prop}".format(**query_data))
+                        edges[(node, relation, prop)] = True
 
                     else:
                         warning_msg = ("The '{prop_typ}' of '{node}' in the module '{domain_model}' is neither a list nor a string." +
@@ -480,6 +862,8 @@ class DomainModelCreator:
                     # info_msg = ("A entry in the properties dict in the module '{domain_model}' does not have a " + str(missing_key) + " property. " + 
                     #             "No {prop_typ} relation for node '{node}' is created!").format(**error_data)
                     # print_info(info_msg)
+
+        self.merge_relations(edges)
          
         if self.opt_verbose or self.opt_v_verbose:
             print_info(relation+" relation creation finished!")
@@ -487,56 +871,182 @@ class DomainModelCreator:
     #
     # Create namespace node creation queries.
     # Dynamically take all properties stated for each namespace in the dicts.
+    # The properties are sent as typed parameters, the namespaces in batches, see unwind_rows.
+    # Namespaces are merged on their title, so a batch replayed by a resumed load does not duplicate them.
     #
     def create_namespaces(self, domain_models):
+        namespaces = []
         for domain_model in domain_models:
             # Check if currently handeled module has a dict called "namespaces"
             # if not skip this module and display warning
             if hasattr(domain_model, "namespaces"):
                 temp_namespaces_dict={}
-                # Iterate each namespace in namespace dict to dynamically create all namespace querries with properties
+                # Iterate each namespace in namespace dict to collect all namespaces with properties
                 # for namespace in domain_model.namespaces:
                 for item in domain_model.namespaces:
                     namespace = item.keys()[0]
                     temp_namespaces_dict.update(item)
-                    # KeyError is raised when a requested key is missing.
-                    try:
-                        query_data = {"namespace": namespace}
-                        query = "Create(:namespace {{title: '{namespace}'".format(**query_data)
-
-                        for prop in temp_namespaces_dict[namespace]:
-                            property_data = {
-                                    "property_name": str(prop),
-                                    "property_value": str(temp_namespaces_dict[namespace][prop])
-                            }                            
-                            if type(temp_namespaces_dict[namespace][prop]) is list:
-                                query = query + ",{property_name}:{property_value}".format(**property_data)
-                            else:
-                                query = query + ",{property_name}:'{property_value}'".format(**property_data)
-
-                        query = query + "})"
-
-                        self.execute_query(query, "Creating namespace node: " + namespace)
-
-                    except KeyError as missing_key:
-                        error_data = {
-                            "domain_model": domain_model.__name__, 
-                            "missing_key": str(missing_key), 
-                            "namespace": str(namespace), 
-                            "dict_entry": str(temp_namespaces_dict[namespace])
-                        }   
-                        warning_msg = ("A entry in the 'namespace' dict in module: '{domain_model}' does not contain a required key." + 
-                                        "The missing key is {missing_key} in '{namespace} : {dict_entry}'. " + 
-                                        "The node {namespace} can not be created!").format(**error_data)
-                        print_warning(warning_msg)
+                    namespaces.append((namespace, temp_namespaces_dict[namespace]))
             else:
                 info_msg = ("No dict called 'namespaces' available in {}. No relations created from this domain-model. " + 
                             "You can safely ignore this, if this is intended.").format(domain_model.__name__)
                 print_info(info_msg)
 
+        query = "UNWIND $rows AS row\nMERGE (node:namespace { title: row.title })\nSET node = row"
+        rows = (namespace_properties(namespace, entry) for namespace, entry in namespaces)
+        self.unwind_rows(query, rows, "Creating {} namespace nodes, starting with {}")
+
         if self.opt_verbose or self.opt_v_verbose:
             print_info("Namespace nodes created!")
 
+    #
+    # Computes the graph the creation scripts are expected to create from the domain models:
+    # The keys (identifier, or title if there is none) of all nodes per label and
+    # the titles of the start and end node of all relations per relation type.
+    # Entries the creation scripts skip due to missing keys are skipped here as well.
+    # Entries merged by the creation scripts (same label and merge key) are counted once.
+    #
+    def expected_graph(self, domain_models):
+        # per label resp. relation type: merge key -> expected value
+        nodes = {}
+        relations = {}
+        # merged once per (start, type, end), see merge_relations
+        class_relations = collections.OrderedDict()
+
+        for domain_model in domain_models:
+            for item in domain_model.classes:
+                for node, entry in item.items():
+                    if "label" in entry and "identifier" in entry:
+                        nodes.setdefault(entry["label"], {})[("identifier", entry["identifier"])] = entry["identifier"]
+
+                    for relation in ["subclass_of", "required_property", "optional_property"]:
+                        targets = entry.get(relation)
+                        if not targets:
+                            continue
+                        if type(targets) is str:
+                            targets = [targets]
+                        if type(targets) is list:
+                            for target in targets:
+                                # 'NULL' marks the root class, no relation can be created to it
+                                if target != "NULL":
+                                    class_relations[(node, relation, target)] = True
+
+            for item in getattr(domain_model, "relations", []):
+                for relation, entry in item.items():
+                    if all(key in entry for key in ["label", "from_entity", "to_entity", "namespace", "identifier"]):
+                        relations.setdefault(entry["label"], {})[(entry["identifier"], entry["from_entity"], entry["to_entity"])] = (
+                            entry["from_entity"], entry["to_entity"])
+
+            for item in getattr(domain_model, "properties", []):
+                for node, entry in item.items():
+                    if "label" in entry and "label2" in entry:
+                        key = ("identifier", entry["identifier"]) if "identifier" in entry else ("title", node)
+                        for label in set([entry["label"], entry["label2"]]):
+                            nodes.setdefault(label, {})[key] = key[1]
+
+            for item in getattr(domain_model, "namespaces", []):
+                for namespace, entry in item.items():
+                    nodes.setdefault("namespace", {})[("title", namespace)] = entry.get("identifier", namespace)
+
+        for node, relation, target in class_relations:
+            relations.setdefault(relation, {})[(node, target)] = (node, target)
+
+        nodes = dict((label, list(keys.values())) for label, keys in nodes.items())
+        relations = dict((relation_type, list(ends.values())) for relation_type, ends in relations.items())
+        return nodes, relations
+
+    #
+    # Compares the loaded graph with the graph expected from the domain models.
+    # Counts per label and relation type are read from the count store of the database and are therefore cheap.
+    # With checksums enabled, order-independent checksums over the node keys and the start and end nodes
+    # of the relations are compared as well. This streams one or two values per node and relation.
+    # Mismatches are reported, but are no warnings: the load is kept and main exits with a non-zero status.
+    # Returns the number of mismatches.
+    #
+    def verify_load(self, domain_models):
+        start = time.time()
+        expected_nodes, expected_relations = self.expected_graph(domain_models)
+        mismatches = 0
+
+        for label in sorted(expected_nodes):
+            query = "MATCH (n:`{}`) RETURN count(n)".format(label)
+            mismatches += self.verify_count("label", label, len(expected_nodes[label]), query)
+            if self.opt_verify_checksums:
+                query = "MATCH (n:`{}`) RETURN coalesce(n.identifier, n.title)".format(label)
+                mismatches += self.verify_checksum("label", label, expected_nodes[label], query)
+
+        for relation in sorted(expected_relations):
+            query = "MATCH ()-[r:`{}`]->() RETURN count(r)".format(relation)
+            mismatches += self.verify_count("relation type", relation, len(expected_relations[relation]), query)
+            if self.opt_verify_checksums:
+                query = "MATCH (a)-[:`{}`]->(b) RETURN a.title, b.title".format(relation)
+                mismatches += self.verify_checksum("relation type", relation, expected_relations[relation], query)
+
+        if mismatches == 0:
+            print_info("Verification passed in {:.2f}s. The graph matches the domain models.".format(time.time() - start))
+        else:
+            print_info("Verification found {} mismatches in {:.2f}s.".format(mismatches, time.time() - start))
+        return mismatches
+
+    #
+    # Compares an expected count with the count returned by the query. Returns the number of mismatches (0 or 1).
+    #
+    def verify_count(self, kind, name, expected, query):
+        found = self.neo4j_connection.run(query).evaluate()
+        if found != expected:
+            print_mismatch("Verification failed for {} '{}': expected {} but found {} in the database.".format(
+                kind, name, expected, found))
+            return 1
+        if self.opt_verbose or self.opt_v_verbose:
+            print("// Verified {} '{}': {}".format(kind, name, found))
+        return 0
+
+    #
+    # Compares the checksum over the expected values with the checksum over the records returned by the query.
+    # Returns the number of mismatches (0 or 1).
+    #
+    def verify_checksum(self, kind, name, expected, query):
+        found = checksum(tuple(record) for record in self.neo4j_connection.run(query))
+        if found != checksum(expected):
+            print_mismatch("Verification failed for {} '{}': the checksums of the loaded and the expected {} differ.".format(
+                kind, name, "nodes" if kind == "label" else "relations"))
+            return 1
+        return 0
+
+    #
+    # Writes the queries of all creation scripts (see PHASES) to std_out or to the output file (see --output).
+    # No database driver is needed for this.
+    #
+    def write_script(self, domain_models):
+        if self.opt_output_file:
+            self.output = open(self.opt_output_file, "w")
+        try:
+            for phase in self.PHASES:
+                getattr(self, phase)(domain_models)
+        finally:
+            if self.output is not sys.stdout:
+                self.output.close()
+                self.output = sys.stdout
+
+        if self.opt_output_file:
+            print_info("Queries written to " + self.opt_output_file)
+
+    #
+    # Writes a script migrating a graph loaded from the old domain models to the new domain models
+    # to the output file (see --output) or to std_out.
+    #
+    def create_migration_script(self, old_domain_models, new_domain_models):
+        old_index = index_domain_models(old_domain_models)
+        new_index = index_domain_models(new_domain_models)
+        diff = diff_indexes(old_index, new_index)
+
+        if self.opt_output_file:
+            with open(self.opt_output_file, "w") as output:
+                write_migration_script(old_index, new_index, diff, output)
+            print_info("Migration script written to " + self.opt_output_file)
+        else:
+            write_migration_script(old_index, new_index, diff, sys.stdout)
+
     #
     # Intialize variabls tracking the options
     #
@@ -545,7 +1055,35 @@ class DomainModelCreator:
         self.opt_verbose = False
         self.opt_v_verbose = False
         self.opt_output_file = False
+        self.output = sys.stdout
+        self.opt_resume = False
+        self.opt_dry_run = False
+        self.opt_profile_queries = False
+        self.query_profiles = collections.OrderedDict()
+        self.opt_verify = False
+        self.opt_verify_checksums = False
+        # None uses one process per CPU
+        self.jobs = None
+        self.migrate_from = []
         self.arguments = []
+
+        # Batching and checkpointing of queries run against the database
+        self.batch_size_min = 1
+        self.batch_size_max = 1000
+        self.commit_latency = 1.0
+        self.max_batch_bytes = self.BATCH_MEMORY * 1024 * 1024
+        self.phase_stats = {}
+        self.pending_queries = []
+        self.pending_bytes = 0
+        self.batch_latency = 0.0
+        self.checkpoint_file = ".graph-populator.checkpoint"
+        self.resume_checkpoint = None
+        self.model_hash = None
+        self.current_phase = None
+        self.phase_offset = 0
+        self.resume_offset = 0
+        self.committed_offset = 0
+        self.batch_index = 0
         
         #
         # Helper function for loading and displaying helpfile
@@ -563,22 +1101,80 @@ class DomainModelCreator:
 
         for o, a in opts:
 
-            if "h" in o or "help" in o or o == "":
+            if o in ["-h", "--help"]:
                 present_helpfile()
                 sys.exit()
 
-            if "vvv" in o:
+            if o == "--vvv":
                 self.opt_verbose = True
                 self.opt_v_verbose = True
                 print_info("Printing all verbose information available. VERY VERY verbose enabled")
-            elif "vv" in o:
+            elif o == "--vv":
                 self.opt_v_verbose = True
                 print_info("VERY verbose enabled")
-            elif "v" in o or "verbose" in o:
+            elif o in ["-v", "--verbose"]:
                 self.opt_verbose = True
                 print_info("Vebose enabaled")
 
-            if "db" in o:
+            if o == "--resume":
+                self.opt_resume = True
+
+            if o == "--dry-run":
+                self.opt_dry_run = True
+
+            if o == "--profile-queries":
+                self.opt_profile_queries = True
+
+            if o == "--checkpoint":
+                self.checkpoint_file = a
+
+            if o == "--jobs":
+                try:
+                    self.jobs = int(a)
+                    if self.jobs < 1: raise ValueError
+                except ValueError:
+                    print("The number of jobs needs to be a positive integer, e.g. '4'")
+                    sys.exit()
+
+            if o == "--migrate-from":
+                self.migrate_from = [dict_file for dict_file in a.split(",") if dict_file]
+
+            if o == "--output":
+                self.opt_output_file = a
+
+            if o == "--verify":
+                self.opt_verify = True
+
+            if o == "--verify-checksums":
+                self.opt_verify = True
+                self.opt_verify_checksums = True
+
+            if o == "--batch-size":
+                try:
+                    # expecting the bounds to be like: min:max
+                    self.batch_size_min, self.batch_size_max = [int(bound) for bound in a.split(":")]
+                    if not 0 < self.batch_size_min <= self.batch_size_max: raise ValueError
+                except ValueError:
+                    print("Batch size bounds need to be stated as MIN:MAX with 0 < MIN <= MAX, e.g. '10:1000'")
+                    sys.exit()
+
+            if o == "--commit-latency":
+                try:
+                    self.commit_latency = float(a)
+                    if self.commit_latency <= 0: raise ValueError
+                except ValueError:
+                    print("The target commit latency needs to be a positive number of seconds, e.g. '0.5'")
+                    sys.exit()
+
+            if o == "--batch-memory":
+                try:
+                    self.max_batch_bytes = int(float(a) * 1024 * 1024)
+                    if self.max_batch_bytes <= 0: raise ValueError
+                except ValueError:
+                    print("The memory per batch needs to be a positive number of MB, e.g. '16'")
+                    sys.exit()
+
+            if o == "--db":
                 try:
                     # expecting database connection string to be like: protocol://user:pwd@ip:port
                     self.db_url = a.split("@")[1]
@@ -602,6 +1198,1311 @@ class DomainModelCreator:
 
 
 
+########################
+# Domain Model Parsing #
+########################
+
+# Dicts of a domain model used for the import
+DOMAIN_MODEL_DICTS = ["classes", "relations", "namespaces", "properties"]
+
+#
+# Imports one python dict file and checks it. Run in the worker processes of import_data_files.
+# argument is a tuple of the position of the file in the arguments and the file name.
+# File names without a directory are imported as modules, files with a directory are loaded from that path.
+# Errors are not raised here but returned as name and arguments of the error,
+# so the main process can report them in the order of the arguments.
+# Returns a dict holding only the name of the module, the error and the dicts in DOMAIN_MODEL_DICTS
+# that are available in the module, so it can be sent cheaply between the processes.
+#
+def parse_domain_model(argument):
+    i, dict_file = argument
+    module_name = os.path.basename(dict_file)[0:-3]
+    parsed_model = {"name": module_name, "error": None}
+
+    try:
+        # Old and new versions of a domain model share the module name, never use a cached one
+        sys.modules.pop(module_name, None)
+        if os.path.dirname(dict_file):
+            domain_model = imp.load_source(module_name, dict_file)
+        else:
+            domain_model = importlib.import_module(module_name)
+    except Exception as exception:
+        parsed_model["error"] = ("ImportError", (str(exception),))
+        return parsed_model
+
+    # Checks if imported files contain at least a dict called "classes"
+    # Checks if other attributs called "relations" or "namespaces" are availabed and if so dicts 
+    # Expected import order is rootclass dict first
+    if hasattr(domain_model, "classes"):
+        if not type(domain_model.classes) is list:
+            parsed_model["error"] = ("NoListError", (domain_model.__name__, "classes"))
+    else:
+        parsed_model["error"] = ("NoClassesListError", (domain_model.__name__,))
+
+    if parsed_model["error"] is None and hasattr(domain_model, "relations"):
+        if not type(domain_model.relations) is list:
+            parsed_model["error"] = ("NoListError", (domain_model.__name__, "relations"))
+
+    if parsed_model["error"] is None:
+        if hasattr(domain_model, "namespaces"):
+            if not type(domain_model.namespaces) is list:
+                parsed_model["error"] = ("NoListError", (domain_model.__name__, "namespaces"))
+        # Rootclass needs namespaces dictornary
+        elif i == 0:
+            parsed_model["error"] = ("UpperMostLevelError", (domain_model.__name__, "namespaces"))
+
+    if parsed_model["error"] is None:
+        parsed_model["name"] = domain_model.__name__
+        for dict_name in DOMAIN_MODEL_DICTS:
+            if hasattr(domain_model, dict_name):
+                parsed_model[dict_name] = getattr(domain_model, dict_name)
+
+    return parsed_model
+
+#
+# Normalized domain model built from the result of parse_domain_model.
+# Has the same attributes as the imported module: __name__ and those dicts in DOMAIN_MODEL_DICTS the module provides.
+#
+class DomainModel(object):
+    def __init__(self, parsed_model):
+        self.__name__ = parsed_model["name"]
+        for dict_name in DOMAIN_MODEL_DICTS:
+            if dict_name in parsed_model:
+                setattr(self, dict_name, parsed_model[dict_name])
+
+###############################
+# Migration Script Generation #
+###############################
+
+# Number of rows sent with one UNWIND statement of a migration script
+MIGRATION_BATCH_SIZE = 500
+
+# Number of characters of a string escaped at once by cypher_literal_parts
+LITERAL_CHUNK_SIZE = 64 * 1024
+
+# Relations between classes stated in the classes dicts
+CLASS_RELATIONS = ["subclass_of", "required_property", "optional_property"]
+
+# Parts of the index built by index_domain_models holding nodes
+NODE_PARTS = ["classes", "properties", "namespaces"]
+
+#
+# Value of a node or relation property as sent by the creation scripts:
+# strings, numbers, booleans and lists keep their type, other values are converted to strings.
+#
+def property_value(value):
+    if isinstance(value, (basestring, bool, int, long, float, list)):
+        return value
+    return str(value)
+
+#
+# Properties of a class node as created by create_nodes
+#
+def class_node_properties(node, entry):
+    properties = {"title": node, "identifier": entry["identifier"]}
+    for prop in entry:
+        if prop not in ["label", "identifier"] + CLASS_RELATIONS:
+            properties[prop] = property_value(entry[prop])
+    return properties
+
+#
+# Properties of an object-property relation as created by create_relations_objectproperty
+#
+def relation_properties(relation, entry):
+    properties = {"title": relation, "namespace": entry["namespace"], "identifier": entry["identifier"]}
+    for prop in entry:
+        if prop not in ["label", "from_entity", "namespace", "to_entity", "identifier"]:
+            properties[prop] = property_value(entry[prop])
+    return properties
+
+#
+# Properties of a property node as created by create_property_nodes
+#
+def property_node_properties(node, entry):
+    properties = {"title": node}
+    for prop in entry:
+        if prop not in ["label", "label2"]:
+            properties[prop] = property_value(entry[prop])
+    return properties
+
+#
+# Properties of a namespace node as created by create_namespaces
+#
+def namespace_properties(namespace, entry):
+    properties = {"title": namespace}
+    for prop in entry:
+        properties[prop] = property_value(entry[prop])
+    return properties
+
+#
+# Builds identifier-keyed indexes of everything the creation scripts create from the domain models.
+# Nodes are keyed by (key property, key) and hold their labels and properties,
+# object-property relations are keyed by (identifier, start, end), as the loader merges them, and hold type, start, end and properties,
+# class relations (subclass_of, required_property, optional_property) are keyed by (start, type, end).
+# Later entries replace earlier entries with the same key, like in the creation scripts.
+# Entries missing required keys are skipped, as the creation scripts can not create them either.
+#
+def index_domain_models(domain_models):
+    index = {
+        "classes": collections.OrderedDict(),
+        "properties": collections.OrderedDict(),
+        "namespaces": collections.OrderedDict(),
+        "relations": collections.OrderedDict(),
+        "class_relations": collections.OrderedDict()
+    }
+
+    for domain_model in domain_models:
+        for item in domain_model.classes:
+            for node, entry in item.items():
+                if "label" in entry and "identifier" in entry:
+                    index["classes"][("identifier", entry["identifier"])] = (
+                        (entry["label"],), class_node_properties(node, entry))
+
+                for relation in CLASS_RELATIONS:
+                    targets = entry.get(relation)
+                    if not targets:
+                        continue
+                    if type(targets) is str:
+                        targets = [targets]
+                    if type(targets) is list:
+                        for target in targets:
+                            index["class_relations"][(node, relation, target)] = True
+
+        for item in getattr(domain_model, "relations", []):
+            for relation, entry in item.items():
+                if all(key in entry for key in ["label", "from_entity", "to_entity", "namespace", "identifier"]):
+                    index["relations"][(entry["identifier"], entry["from_entity"], entry["to_entity"])] = (
+                        entry["label"], entry["from_entity"], entry["to_entity"], relation_properties(relation, entry))
+
+        for item in getattr(domain_model, "properties", []):
+            for node, entry in item.items():
+                if "label" in entry and "label2" in entry:
+                    key = ("identifier", entry["identifier"]) if "identifier" in entry else ("title", node)
+                    index["properties"][key] = ((entry["label"], entry["label2"]), property_node_properties(node, entry))
+
+        for item in getattr(domain_model, "namespaces", []):
+            for namespace, entry in item.items():
+                index["namespaces"][("title", namespace)] = (("namespace",), namespace_properties(namespace, entry))
+
+    return index
+
+#
+# Compares two indexes built by index_domain_models in linear time.
+# Returns for each part of the index the keys that were added, removed or changed (same key, other content),
+# and for the node parts the (old key, new key) pairs of re-keyed nodes, see pair_rekeyed_nodes.
+#
+def diff_indexes(old_index, new_index):
+    diff = {}
+    for part in old_index:
+        old_part = old_index[part]
+        new_part = new_index[part]
+        diff[part] = {
+            "added": [key for key in new_part if key not in old_part],
+            "removed": [key for key in old_part if key not in new_part],
+            "changed": [key for key in new_part if key in old_part and new_part[key] != old_part[key]],
+            "rekeyed": []
+        }
+        if part in NODE_PARTS:
+            pair_rekeyed_nodes(old_part, new_part, diff[part])
+    return diff
+
+#
+# Nodes whose key changed but whose title did not (e.g. a new base URI of all identifiers) are re-keyed:
+# they are moved from removed and added to (old key, new key) pairs and updated in place by the migration,
+# as deleting them would also delete their relations, which refer to titles and are therefore unchanged.
+#
+def pair_rekeyed_nodes(old_part, new_part, part_diff):
+    removed_by_title = dict((old_part[key][1]["title"], key) for key in part_diff["removed"])
+    added = []
+    for key in part_diff["added"]:
+        old_key = removed_by_title.pop(new_part[key][1]["title"], None)
+        if old_key is None:
+            added.append(key)
+        else:
+            part_diff["rekeyed"].append((old_key, key))
+
+    rekeyed_old_keys = set(old_key for old_key, new_key in part_diff["rekeyed"])
+    part_diff["added"] = added
+    part_diff["removed"] = [key for key in part_diff["removed"] if key not in rekeyed_old_keys]
+
+#
+# Writes a cypher-shell script migrating a graph created from the old domain models to the new ones.
+# Rows of the same kind are sent in batches of MIGRATION_BATCH_SIZE with one parameterized UNWIND statement each.
+# Relations are removed first and created last, so renamed nodes are matched by their old and new title respectively.
+#
+def write_migration_script(old_index, new_index, diff, output):
+
+    # collects (template, rows) pairs; the template is shared by all rows of a batch
+    statements = []
+
+    def add_statements(template, rows):
+        for i in range(0, len(rows), MIGRATION_BATCH_SIZE):
+            statements.append((template, rows[i:i + MIGRATION_BATCH_SIZE]))
+
+    def node_pattern(labels, key_property):
+        return "(n{} {{`{}`: row.key}})".format("".join(":`{}`".format(label) for label in labels), key_property)
+
+    def group_rows(keys, row_for_key, group_for_key):
+        groups = collections.OrderedDict()
+        for key in keys:
+            groups.setdefault(group_for_key(key), []).append(row_for_key(key))
+        return groups
+
+    # Remove relations that were removed or changed their type (end points are part of the key)
+    removed_class_relations = group_rows(
+        diff["class_relations"]["removed"],
+        lambda key: {"from": key[0], "to": key[2]},
+        lambda key: key[1])
+    for relation_type, rows in removed_class_relations.items():
+        add_statements(("UNWIND $rows AS row MATCH (a:TBox {{title: row.from}})-[r:`{}`]->(b:TBox {{title: row.to}}) " +
+                        "DELETE r").format(relation_type), rows)
+
+    # changed relations are split in one pass: moved ones (other type) are deleted and created again, the others are updated
+    moved_relations = []
+    updated_relation_keys = []
+    for key in diff["relations"]["changed"]:
+        if old_index["relations"][key][:3] != new_index["relations"][key][:3]:
+            moved_relations.append(key)
+        else:
+            updated_relation_keys.append(key)
+    removed_relations = group_rows(
+        diff["relations"]["removed"] + moved_relations,
+        lambda key: {"identifier": key[0], "from": key[1], "to": key[2]},
+        lambda key: old_index["relations"][key][0])
+    for relation_type, rows in removed_relations.items():
+        add_statements(("UNWIND $rows AS row MATCH (a:TBox {{title: row.from}})-[r:`{}` {{identifier: row.identifier}}]->" +
+                        "(b:TBox {{title: row.to}}) DELETE r").format(relation_type), rows)
+
+    # Remove, update and create nodes
+    for part in NODE_PARTS:
+        old_part = old_index[part]
+        new_part = new_index[part]
+
+        removed = group_rows(diff[part]["removed"], lambda key: {"key": key[1]}, lambda key: (old_part[key][0], key[0]))
+        for (labels, key_property), rows in removed.items():
+            add_statements("UNWIND $rows AS row MATCH {} DETACH DELETE n".format(node_pattern(labels, key_property)), rows)
+
+        # changed and re-keyed nodes are matched by their old key and updated in place, keeping their relations
+        changed = group_rows(
+            [(key, key) for key in diff[part]["changed"]] + diff[part]["rekeyed"],
+            lambda keys: {"key": keys[0][1], "props": new_part[keys[1]][1]},
+            lambda keys: (old_part[keys[0]][0], new_part[keys[1]][0], keys[0][0]))
+        for (old_labels, new_labels, key_property), rows in changed.items():
+            template = "UNWIND $rows AS row MATCH {} SET n = row.props".format(node_pattern(old_labels, key_property))
+            if old_labels != new_labels:
+                template += " REMOVE n{} SET n{}".format(
+                    "".join(":`{}`".format(label) for label in old_labels),
+                    "".join(":`{}`".format(label) for label in new_labels))
+            add_statements(template, rows)
+
+        added = group_rows(diff[part]["added"], lambda key: {"props": new_part[key][1]}, lambda key: new_part[key][0])
+        for labels, rows in added.items():
+            add_statements("UNWIND $rows AS row CREATE (n{}) SET n = row.props".format(
+                "".join(":`{}`".format(label) for label in labels)), rows)
+
+    # Create relations that were added or changed their type, update the properties of the others
+    added_class_relations = group_rows(
+        diff["class_relations"]["added"],
+        lambda key: {"from": key[0], "to": key[2]},
+        lambda key: key[1])
+    for relation_type, rows in added_class_relations.items():
+        add_statements(("UNWIND $rows AS row MATCH (a:TBox {{title: row.from}}), (b:TBox {{title: row.to}}) " +
+                        "CREATE (a)-[:`{}`]->(b)").format(relation_type), rows)
+
+    added_relations = group_rows(
+        diff["relations"]["added"] + moved_relations,
+        lambda key: {"from": new_index["relations"][key][1], "to": new_index["relations"][key][2], "props": new_index["relations"][key][3]},
+        lambda key: new_index["relations"][key][0])
+    for relation_type, rows in added_relations.items():
+        add_statements(("UNWIND $rows AS row MATCH (a:TBox {{title: row.from}}), (b:TBox {{title: row.to}}) " +
+                        "CREATE (a)-[r:`{}`]->(b) SET r = row.props").format(relation_type), rows)
+
+    updated_relations = group_rows(
+        updated_relation_keys,
+        lambda key: {"identifier": key[0], "from": key[1], "to": key[2], "props": new_index["relations"][key][3]},
+        lambda key: new_index["relations"][key][0])
+    for relation_type, rows in updated_relations.items():
+        add_statements(("UNWIND $rows AS row MATCH (a:TBox {{title: row.from}})-[r:`{}` {{identifier: row.identifier}}]->" +
+                        "(b:TBox {{title: row.to}}) SET r = row.props").format(relation_type), rows)
+
+    # Write the script
+    output.write("// Migration script generated by graph-populator.py\n")
+    for part in NODE_PARTS + ["relations", "class_relations"]:
+        output.write("// {}: {} added, {} removed, {} changed, {} re-keyed\n".format(
+            part, len(diff[part]["added"]), len(diff[part]["removed"]), len(diff[part]["changed"]), len(diff[part]["rekeyed"])))
+    if not statements:
+        output.write("// The domain models are equal, nothing to migrate.\n")
+
+    for template, rows in statements:
+        output.write("\n:param rows => ")
+        write_cypher_literal(rows, output)
+        output.write("\n" + template + ";\n")
+
+#
+# Writes a python value as cypher literal to output, piece by piece,
+# so large lists and long strings are not copied into one big string first.
+#
+def write_cypher_literal(value, output):
+    for part in cypher_literal_parts(value):
+        output.write(part)
+
+#
+# Generates the pieces of the cypher literal of a python value.
+# Supports None, booleans, numbers, strings, lists, tuples and dicts with string keys.
+#
+def cypher_literal_parts(value):
+    if value is None:
+        yield "null"
+    elif type(value) is bool:
+        yield "true" if value else "false"
+    elif isinstance(value, (int, long, float)):
+        yield repr(value)
+    elif isinstance(value, basestring):
+        # long strings are escaped in chunks, escapes never span more than one character
+        yield "'"
+        for start in range(0, len(value), LITERAL_CHUNK_SIZE):
+            chunk = value[start:start + LITERAL_CHUNK_SIZE]
+            if isinstance(chunk, unicode):
+                chunk = chunk.encode("utf-8")
+            yield chunk.replace("\\", "\\\\").replace("'", "\\'").replace("\n", "\\n").replace("\r", "\\r")
+        yield "'"
+    elif isinstance(value, (list, tuple)):
+        yield "["
+        for i, item in enumerate(value):
+            if i > 0:
+                yield ", "
+            for part in cypher_literal_parts(item):
+                yield part
+        yield "]"
+    elif isinstance(value, dict):
+        yield "{"
+        for i, key in enumerate(value):
+            if i > 0:
+                yield ", "
+            yield "`{}`: ".format(str(key).replace("`", "``"))
+            for part in cypher_literal_parts(value[key]):
+                yield part
+        yield "}"
+    else:
+        raise TypeError("Can not convert {} to a cypher literal".format(type(value).__name__))
+
+
+############################
+# In-Memory Graph Backend #
+############################
+
+#
+# MemoryGraphError is raised by the in-memory graph for queries it does not support,
+# faulty queries and violated constraints, where Neo4j would raise a client error.
+#
+class MemoryGraphError(Exception):
+    pass
+
+#
+# Node of the in-memory graph
+#
+class MemoryNode(object):
+    __slots__ = ["id", "labels", "properties"]
+
+    def __init__(self, node_id, labels, properties):
+        self.id = node_id
+        self.labels = set(labels)
+        self.properties = properties
+
+#
+# Relationship of the in-memory graph
+#
+class MemoryRelationship(object):
+    __slots__ = ["id", "type", "start", "end", "properties"]
+
+    def __init__(self, relationship_id, relationship_type, start, end, properties):
+        self.id = relationship_id
+        self.type = relationship_type
+        self.start = start
+        self.end = end
+        self.properties = properties
+
+#
+# Result of a query run against the in-memory graph. Offers the parts of the py2neo cursor used by this script.
+#
+class MemoryCursor(object):
+
+    def __init__(self, keys, records):
+        self._keys = keys
+        self._records = records
+
+    def keys(self):
+        return list(self._keys)
+
+    def evaluate(self, field=0):
+        if not self._records:
+            return None
+        return self._records[0][field]
+
+    def data(self):
+        return [dict(zip(self._keys, record)) for record in self._records]
+
+    def __iter__(self):
+        return iter(self._records)
+
+#
+# Transaction on the in-memory graph. Changes are applied immediately and undone on rollback.
+#
+class MemoryTransaction(object):
+
+    def __init__(self, graph):
+        self.graph = graph
+        self.undo_log = []
+
+    def run(self, query, parameters=None, **kwparameters):
+        return self.graph.execute(query, parameters, kwparameters, self.undo_log)
+
+    def commit(self):
+        self.undo_log = []
+
+    def rollback(self):
+        for undo in reversed(self.undo_log):
+            undo()
+        self.undo_log = []
+
+#
+# In-process property graph used instead of a Neo4j database for dry runs (see --dry-run).
+# Holds labelled nodes and typed relationships, with hash indexes on the properties in INDEXED_PROPERTIES
+# (and on properties with a unique constraint) per label, and an index on (start, type, end) of the relationships.
+# Offers run() and begin() like py2neo.Graph and understands the subset of cypher this script emits:
+# UNWIND, MATCH, CREATE, MERGE, SET, REMOVE, [DETACH] DELETE, RETURN with count() and coalesce(),
+# and CREATE CONSTRAINT ... IS UNIQUE. Every query is atomic, a failing query leaves the graph unchanged.
+#
+class MemoryGraph(object):
+
+    INDEXED_PROPERTIES = ["identifier", "title"]
+
+    # Parsed queries are cached by their text, parameterized queries are sent many times
+    PARSE_CACHE_SIZE = 1000
+
+    def __init__(self):
+        self.nodes = {}
+        self.relationships = {}
+        self.labels = {}
+        self.types = {}
+        self.outgoing = {}
+        self.incoming = {}
+        self.edges = {}
+        self.indexed_properties = set(self.INDEXED_PROPERTIES)
+        self.index = {}
+        self.unique = set()
+        self.next_id = 0
+        self.undo = None
+        self.parse_cache = {}
+
+    #
+    # Interface of py2neo.Graph
+    #
+    def run(self, query, parameters=None, **kwparameters):
+        return self.execute(query, parameters, kwparameters, None)
+
+    def begin(self):
+        return MemoryTransaction(self)
+
+    #
+    # Number of nodes per label and relationships per type
+    #
+    def counts(self):
+        return (dict((label, len(ids)) for label, ids in self.labels.items() if ids),
+                dict((relationship_type, len(ids)) for relationship_type, ids in self.types.items() if ids))
+
+    #
+    # Parses and runs a query. Changes are recorded in self.undo while the query runs,
+    # undone if it fails and otherwise handed to the undo log of the transaction.
+    #
+    def execute(self, query, parameters, kwparameters, undo_log):
+        params = dict(parameters or {})
+        params.update(kwparameters)
+
+        statement = self.parse_cache.get(query)
+        if statement is None:
+            statement = CypherParser(query).parse()
+            if len(self.parse_cache) >= self.PARSE_CACHE_SIZE:
+                self.parse_cache.clear()
+            self.parse_cache[query] = statement
+
+        self.undo = []
+        try:
+            cursor = self.execute_statement(statement, params)
+        except Exception:
+            undo, self.undo = self.undo, None
+            for change in reversed(undo):
+                change()
+            raise
+
+        undo, self.undo = self.undo, None
+        if undo_log is not None:
+            undo_log.extend(undo)
+        return cursor
+
+    #
+    # Records how to undo a change, while a query is running
+    #
+    def record(self, undo):
+        if self.undo is not None:
+            self.undo.append(undo)
+
+    def execute_statement(self, statement, params):
+        rows = [{}]
+        result = MemoryCursor([], [])
+
+        for clause in statement:
+            kind = clause[0]
+            if kind == "constraint":
+                self.create_unique_constraint(clause[1], clause[2])
+            elif kind == "unwind":
+                rows = self.unwind(rows, clause[1], clause[2], params)
+            elif kind == "match":
+                for pattern in clause[1]:
+                    rows = [matched for row in rows for matched in self.match_pattern(pattern, row, params)]
+            elif kind == "create":
+                for row in rows:
+                    for pattern in clause[1]:
+                        self.create_pattern(pattern, row, params)
+            elif kind == "merge":
+                rows = [self.merge_pattern(clause[1], row, params) for row in rows]
+            elif kind == "set":
+                for row in rows:
+                    for item in clause[1]:
+                        self.set_item(item, row, params)
+            elif kind == "remove":
+                for row in rows:
+                    for item in clause[1]:
+                        self.remove_item(item, row)
+            elif kind == "delete":
+                for row in rows:
+                    for variable in clause[2]:
+                        self.delete_entity(row.get(variable), clause[1])
+            elif kind == "return":
+                result = self.return_rows(rows, clause[1], params)
+
+        return result
+
+    #
+    # Clauses
+    #
+    def unwind(self, rows, expression, variable, params):
+        unwound = []
+        for row in rows:
+            values = self.evaluate(expression, row, params)
+            if values is None:
+                continue
+            if not isinstance(values, (list, tuple)):
+                values = [values]
+            for value in values:
+                new_row = dict(row)
+                new_row[variable] = value
+                unwound.append(new_row)
+        return unwound
+
+    def match_pattern(self, pattern, row, params):
+        first = pattern[0]
+
+        # (a)-[:TYPE]->(b) without constraints on (a) is matched via the relationships of that type
+        if (len(pattern) == 3 and pattern[1]["type"] is not None and not first["labels"] and not first["properties"]
+                and (first["variable"] is None or first["variable"] not in row)):
+            for relationship_id in list(self.types.get(pattern[1]["type"], ())):
+                relationship = self.relationships[relationship_id]
+                new_row = self.bind(row, first["variable"], self.nodes[relationship.start])
+                matched = self.match_relationship(pattern[1], pattern[2], relationship, new_row, params)
+                if matched is not None:
+                    yield matched
+            return
+
+        for node in self.candidates(first, row, params):
+            for matched in self.match_rest(pattern, 1, node, self.bind(row, first["variable"], node), params):
+                yield matched
+
+    def match_rest(self, pattern, i, previous, row, params):
+        if i >= len(pattern):
+            yield row
+            return
+        relationship_pattern = pattern[i]
+        if relationship_pattern["type"] is not None:
+            relationship_ids = [relationship_id
+                                for end in self.outgoing.get(previous.id, {})
+                                for relationship_id in self.edges.get((previous.id, relationship_pattern["type"], end), ())]
+        else:
+            relationship_ids = [relationship_id for ids in self.outgoing.get(previous.id, {}).values() for relationship_id in ids]
+        for relationship_id in relationship_ids:
+            matched = self.match_relationship(relationship_pattern, pattern[i + 1], self.relationships[relationship_id], row, params)
+            if matched is not None:
+                for rest in self.match_rest(pattern, i + 2, self.nodes[self.relationships[relationship_id].end], matched, params):
+                    yield rest
+
+    def match_relationship(self, relationship_pattern, end_pattern, relationship, row, params):
+        if relationship_pattern["type"] is not None and relationship.type != relationship_pattern["type"]:
+            return None
+        variable = relationship_pattern["variable"]
+        if variable is not None and variable in row and row[variable] is not relationship:
+            return None
+        if not self.has_properties(relationship, relationship_pattern["properties"], row, params):
+            return None
+        end = self.nodes[relationship.end]
+        if not self.node_matches(end_pattern, end, row, params):
+            return None
+        return self.bind(self.bind(row, variable, relationship), end_pattern["variable"], end)
+
+    def create_pattern(self, pattern, row, params):
+        previous = self.create_node_pattern(pattern[0], row, params)
+        for i in range(1, len(pattern), 2):
+            relationship_pattern = pattern[i]
+            node = self.create_node_pattern(pattern[i + 1], row, params)
+            if relationship_pattern["type"] is None:
+                raise MemoryGraphError("Exactly one relationship type must be specified for CREATE")
+            relationship = self.create_relationship(relationship_pattern["type"], previous, node,
+                                                    self.evaluate_map(relationship_pattern["properties"], row, params))
+            if relationship_pattern["variable"] is not None:
+                row[relationship_pattern["variable"]] = relationship
+            previous = node
+
+    def create_node_pattern(self, node_pattern, row, params):
+        variable = node_pattern["variable"]
+        if variable is not None and variable in row:
+            return row[variable]
+        node = self.create_node(node_pattern["labels"], self.evaluate_map(node_pattern["properties"], row, params))
+        if variable is not None:
+            row[variable] = node
+        return node
+
+    def merge_pattern(self, pattern, row, params):
+        if len(pattern) == 1:
+            for node in self.candidates(pattern[0], row, params):
+                return self.bind(row, pattern[0]["variable"], node)
+            new_row = dict(row)
+            self.create_pattern(pattern, new_row, params)
+            return new_row
+
+        if len(pattern) != 3 or any(pattern[i]["variable"] not in row for i in [0, 2]):
+            raise MemoryGraphError("MERGE is only supported for single nodes and relationships between bound nodes")
+        for matched in self.match_rest(pattern, 1, row[pattern[0]["variable"]], row, params):
+            if matched[pattern[2]["variable"]] is row[pattern[2]["variable"]]:
+                return matched
+        new_row = dict(row)
+        self.create_pattern(pattern, new_row, params)
+        return new_row
+
+    def set_item(self, item, row, params):
+        kind, variable = item[0], item[1]
+        entity = row.get(variable)
+        if entity is None:
+            return
+        if kind == "labels":
+            for label in item[2]:
+                self.add_label(entity, label)
+            return
+        if kind == "property":
+            properties = dict(entity.properties)
+            properties[item[2]] = self.evaluate(item[3], row, params)
+        else:
+            value = self.evaluate(item[2], row, params)
+            if isinstance(value, (MemoryNode, MemoryRelationship)):
+                value = value.properties
+            if not isinstance(value, dict):
+                raise MemoryGraphError("Expected a map to set the properties of '{}'".format(variable))
+            properties = dict(entity.properties) if kind == "add_properties" else {}
+            properties.update(value)
+        self.replace_properties(entity, properties)
+
+    def remove_item(self, item, row):
+        entity = row.get(item[1])
+        if entity is None:
+            return
+        if item[0] == "labels":
+            for label in item[2]:
+                self.remove_label(entity, label)
+        else:
+            properties = dict(entity.properties)
+            properties.pop(item[2], None)
+            self.replace_properties(entity, properties)
+
+    def delete_entity(self, entity, detach):
+        if isinstance(entity, MemoryRelationship):
+            if entity.id in self.relationships:
+                self.delete_relationship(entity)
+        elif isinstance(entity, MemoryNode):
+            if entity.id not in self.nodes:
+                return
+            relationship_ids = ([relationship_id for ids in self.outgoing[entity.id].values() for relationship_id in ids] +
+                                [relationship_id for ids in self.incoming[entity.id].values() for relationship_id in ids])
+            if relationship_ids and not detach:
+                raise MemoryGraphError("Cannot delete node<{}>, because it still has relationships. "
+                                       "To delete this node, you must first delete its relationships.".format(entity.id))
+            for relationship_id in set(relationship_ids):
+                self.delete_relationship(self.relationships[relationship_id])
+            self.delete_node(entity)
+        elif entity is not None:
+            raise MemoryGraphError("Expected a node or relationship to delete")
+
+    def return_rows(self, rows, items, params):
+        keys = [alias for expression, alias in items]
+        aggregated = [expression[0] == "count" for expression, alias in items]
+
+        if not any(aggregated):
+            return MemoryCursor(keys, [tuple(self.evaluate(expression, row, params) for expression, alias in items) for row in rows])
+
+        groups = collections.OrderedDict()
+        for row in rows:
+            group = tuple(self.evaluate(expression, row, params) if not aggregated[i] else None
+                          for i, (expression, alias) in enumerate(items))
+            counts = groups.setdefault(group, [0] * len(items))
+            for i, (expression, alias) in enumerate(items):
+                if aggregated[i] and (expression[1] is None or self.evaluate(expression[1], row, params) is not None):
+                    counts[i] += 1
+
+        # Aggregation without grouping keys returns one row, even without any matches
+        if not groups and all(aggregated):
+            groups[tuple(None for item in items)] = [0] * len(items)
+
+        return MemoryCursor(keys, [tuple(counts[i] if aggregated[i] else group[i] for i in range(len(items)))
+                                   for group, counts in groups.items()])
+
+    #
+    # Matching helpers
+    #
+    def bind(self, row, variable, value):
+        if variable is None:
+            return row
+        new_row = dict(row)
+        new_row[variable] = value
+        return new_row
+
+    def candidates(self, node_pattern, row, params):
+        variable = node_pattern["variable"]
+        if variable is not None and variable in row:
+            if isinstance(row[variable], MemoryNode) and self.node_matches(node_pattern, row[variable], row, params):
+                yield row[variable]
+            return
+
+        properties = self.evaluate_map(node_pattern["properties"], row, params)
+        node_ids = None
+        for label in node_pattern["labels"]:
+            for key in properties:
+                if key in self.indexed_properties and is_hashable(properties[key]):
+                    node_ids = self.index.get((label, key), {}).get(properties[key], ())
+                    break
+            if node_ids is not None:
+                break
+        if node_ids is None and node_pattern["labels"]:
+            node_ids = self.labels.get(node_pattern["labels"][0], ())
+        if node_ids is None:
+            node_ids = self.nodes.keys()
+
+        for node_id in list(node_ids):
+            node = self.nodes[node_id]
+            if all(label in node.labels for label in node_pattern["labels"]) and \
+                    all(node.properties.get(key) == value for key, value in properties.items()):
+                yield node
+
+    def node_matches(self, node_pattern, node, row, params):
+        variable = node_pattern["variable"]
+        if variable is not None and variable in row and row[variable] is not node:
+            return False
+        if not all(label in node.labels for label in node_pattern["labels"]):
+            return False
+        return self.has_properties(node, node_pattern["properties"], row, params)
+
+    def has_properties(self, entity, properties, row, params):
+        for key, expression in properties:
+            if entity.properties.get(key) != self.evaluate(expression, row, params):
+                return False
+        return True
+
+    #
+    # Expressions
+    #
+    def evaluate_map(self, properties, row, params):
+        return dict((key, self.evaluate(expression, row, params)) for key, expression in properties)
+
+    def evaluate(self, expression, row, params):
+        kind = expression[0]
+        if kind == "literal":
+            return expression[1]
+        if kind == "parameter":
+            if expression[1] not in params:
+                raise MemoryGraphError("Expected parameter(s): " + expression[1])
+            return params[expression[1]]
+        if kind == "variable":
+            if expression[1] not in row:
+                raise MemoryGraphError("Variable `{}` not defined".format(expression[1]))
+            return row[expression[1]]
+        if kind == "property":
+            value = self.evaluate(expression[1], row, params)
+            if isinstance(value, (MemoryNode, MemoryRelationship)):
+                return value.properties.get(expression[2])
+            if isinstance(value, dict):
+                return value.get(expression[2])
+            if value is None:
+                return None
+            raise MemoryGraphError("Type mismatch: expected a map, node or relationship for property '{}'".format(expression[2]))
+        if kind == "list":
+            return [self.evaluate(item, row, params) for item in expression[1]]
+        if kind == "map":
+            return self.evaluate_map(expression[1], row, params)
+        if kind == "coalesce":
+            for argument in expression[1]:
+                value = self.evaluate(argument, row, params)
+                if value is not None:
+                    return value
+            return None
+        raise MemoryGraphError("Aggregation is only supported in RETURN")
+
+    #
+    # Changes of the graph. Each change records how to undo it.
+    #
+    def create_node(self, labels, properties):
+        node = MemoryNode(self.next_id, labels, dict((key, value) for key, value in properties.items() if value is not None))
+        self.next_id += 1
+        self.nodes[node.id] = node
+        self.outgoing[node.id] = {}
+        self.incoming[node.id] = {}
+        self.record(lambda: self.delete_node(node))
+        for label in node.labels:
+            self.labels.setdefault(label, set()).add(node.id)
+            self.index_node(node, label)
+        return node
+
+    def delete_node(self, node):
+        for label in node.labels:
+            self.labels[label].discard(node.id)
+            self.unindex_node(node, label)
+        del self.nodes[node.id]
+        del self.outgoing[node.id]
+        del self.incoming[node.id]
+        self.record(lambda: self.restore_node(node))
+
+    def restore_node(self, node):
+        self.nodes[node.id] = node
+        self.outgoing[node.id] = {}
+        self.incoming[node.id] = {}
+        for label in node.labels:
+            self.labels.setdefault(label, set()).add(node.id)
+            self.index_node(node, label, check=False)
+
+    def create_relationship(self, relationship_type, start, end, properties):
+        relationship = MemoryRelationship(self.next_id, relationship_type, start.id, end.id,
+                                          dict((key, value) for key, value in properties.items() if value is not None))
+        self.next_id += 1
+        self.restore_relationship(relationship)
+        self.record(lambda: self.delete_relationship(relationship))
+        return relationship
+
+    def restore_relationship(self, relationship):
+        self.relationships[relationship.id] = relationship
+        self.types.setdefault(relationship.type, set()).add(relationship.id)
+        self.outgoing[relationship.start].setdefault(relationship.end, set()).add(relationship.id)
+        self.incoming[relationship.end].setdefault(relationship.start, set()).add(relationship.id)
+        self.edges.setdefault((relationship.start, relationship.type, relationship.end), set()).add(relationship.id)
+
+    def delete_relationship(self, relationship):
+        del self.relationships[relationship.id]
+        self.types[relationship.type].discard(relationship.id)
+        for adjacency, node_id, other_id in [(self.outgoing, relationship.start, relationship.end),
+                                             (self.incoming, relationship.end, relationship.start)]:
+            if node_id in adjacency:
+                adjacency[node_id][other_id].discard(relationship.id)
+                if not adjacency[node_id][other_id]:
+                    del adjacency[node_id][other_id]
+        key = (relationship.start, relationship.type, relationship.end)
+        self.edges[key].discard(relationship.id)
+        if not self.edges[key]:
+            del self.edges[key]
+        self.record(lambda: self.restore_relationship(relationship))
+
+    def replace_properties(self, entity, properties):
+        old_properties = entity.properties
+        properties = dict((key, value) for key, value in properties.items() if value is not None)
+        if isinstance(entity, MemoryNode):
+            for label in entity.labels:
+                self.unindex_node(entity, label)
+            entity.properties = properties
+            self.record(lambda: self.restore_properties(entity, old_properties))
+            for label in entity.labels:
+                self.index_node(entity, label)
+        else:
+            entity.properties = properties
+            self.record(lambda: self.restore_properties(entity, old_properties))
+
+    def restore_properties(self, entity, properties):
+        if isinstance(entity, MemoryNode):
+            for label in entity.labels:
+                self.unindex_node(entity, label)
+            entity.properties = properties
+            for label in entity.labels:
+                self.index_node(entity, label, check=False)
+        else:
+            entity.properties = properties
+
+    def add_label(self, node, label):
+        if label in node.labels:
+            return
+        node.labels.add(label)
+        self.labels.setdefault(label, set()).add(node.id)
+        self.record(lambda: self.remove_label(node, label))
+        self.index_node(node, label)
+
+    def remove_label(self, node, label):
+        if label not in node.labels:
+            return
+        self.unindex_node(node, label)
+        node.labels.discard(label)
+        self.labels[label].discard(node.id)
+        self.record(lambda: self.add_label(node, label))
+
+    #
+    # Indexes and constraints
+    #
+    def create_unique_constraint(self, label, key):
+        if (label, key) in self.unique:
+            return
+        self.unique.add((label, key))
+        self.record(lambda: self.unique.discard((label, key)))
+        if key not in self.indexed_properties:
+            self.indexed_properties.add(key)
+            for node_id in self.labels.get(label, ()):
+                self.index_node(self.nodes[node_id], label, check=False)
+        values = set()
+        for node_id in self.labels.get(label, ()):
+            value = self.nodes[node_id].properties.get(key)
+            if value in values:
+                raise MemoryGraphError("Unable to create CONSTRAINT ON ( n:{} ) ASSERT n.{} IS UNIQUE".format(label, key))
+            if value is not None:
+                values.add(value)
+
+    def index_node(self, node, label, check=True):
+        for key in self.indexed_properties:
+            value = node.properties.get(key)
+            if value is None or not is_hashable(value):
+                continue
+            node_ids = self.index.setdefault((label, key), {}).setdefault(value, set())
+            if check and (label, key) in self.unique and node_ids - set([node.id]):
+                raise MemoryGraphError("Node({}) already exists with label `{}` and property `{}` = '{}'".format(
+                    next(iter(node_ids)), label, key, value))
+            node_ids.add(node.id)
+
+    def unindex_node(self, node, label):
+        for key in self.indexed_properties:
+            value = node.properties.get(key)
+            if value is None or not is_hashable(value):
+                continue
+            node_ids = self.index.get((label, key), {}).get(value)
+            if node_ids is not None:
+                node_ids.discard(node.id)
+                if not node_ids:
+                    del self.index[(label, key)][value]
+
+#
+# Checks if a property value can be used as key of an index
+#
+def is_hashable(value):
+    try:
+        hash(value)
+        return True
+    except TypeError:
+        return False
+
+# Tokens of the cypher subset understood by CypherParser
+CYPHER_TOKENS = re.compile(r"""
+      (?P<space>\s+|//[^\n]*)
+    | (?P<string>'(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*")
+    | (?P<name>`(?:[^`]|``)*`)
+    | (?P<number>\d+(?:\.\d+)?)
+    | (?P<parameter>\$\w+)
+    | (?P<word>[A-Za-z_]\w*)
+    | (?P<symbol>->|<-|\+=|[-()\[\]{}:,.=;*])
+""", re.VERBOSE)
+
+CYPHER_ESCAPES = {"n": "\n", "r": "\r", "t": "\t", "b": "\b", "f": "\f"}
+
+#
+# Parses the cypher subset understood by the in-memory graph into a list of clauses.
+# Patterns are lists of node and relationship patterns, expressions are tuples of their kind and arguments.
+#
+class CypherParser(object):
+
+    def __init__(self, query):
+        self.query = query
+        self.tokens = []
+        position = 0
+        while position < len(query):
+            match = CYPHER_TOKENS.match(query, position)
+            if match is None:
+                self.error("Invalid input '{}'".format(query[position]))
+            position = match.end()
+            kind = match.lastgroup
+            if kind == "space":
+                continue
+            value = match.group(kind)
+            if kind == "string":
+                value = re.sub(r"\\(.)", lambda escape: CYPHER_ESCAPES.get(escape.group(1), escape.group(1)), value[1:-1])
+            elif kind == "name":
+                kind, value = "word", value[1:-1].replace("``", "`")
+            elif kind == "number":
+                value = float(value) if "." in value else int(value)
+            elif kind == "parameter":
+                value = value[1:]
+            self.tokens.append((kind, value, match.group(kind)))
+        self.position = 0
+
+    def error(self, message):
+        raise MemoryGraphError("{} in query: {}".format(message, self.query.strip()))
+
+    #
+    # Token helpers
+    #
+    def peek(self, offset=0):
+        if self.position + offset < len(self.tokens):
+            return self.tokens[self.position + offset]
+        return (None, None, None)
+
+    def next_token(self):
+        token = self.peek()
+        if token[0] is None:
+            self.error("Unexpected end of input")
+        self.position += 1
+        return token
+
+    def at_symbol(self, symbol, offset=0):
+        token = self.peek(offset)
+        return token[0] == "symbol" and token[1] == symbol
+
+    def at_keyword(self, keyword, offset=0):
+        token = self.peek(offset)
+        return token[0] == "word" and token[2].upper() == keyword
+
+    def expect_symbol(self, symbol):
+        if not self.at_symbol(symbol):
+            self.error("Expected '{}' but found '{}'".format(symbol, self.peek()[2]))
+        self.position += 1
+
+    def expect_keyword(self, keyword):
+        if not self.at_keyword(keyword):
+            self.error("Expected {} but found '{}'".format(keyword, self.peek()[2]))
+        self.position += 1
+
+    def name(self):
+        token = self.next_token()
+        if token[0] != "word":
+            self.error("Expected a name but found '{}'".format(token[2]))
+        return token[1]
+
+    #
+    # Statement and clauses
+    #
+    def parse(self):
+        clauses = []
+        if self.at_keyword("PROFILE") or self.at_keyword("EXPLAIN"):
+            self.position += 1
+
+        if self.at_keyword("CREATE") and self.at_keyword("CONSTRAINT", 1):
+            self.position += 2
+            self.expect_keyword("ON")
+            self.expect_symbol("(")
+            variable = self.name()
+            self.expect_symbol(":")
+            label = self.name()
+            self.expect_symbol(")")
+            self.expect_keyword("ASSERT")
+            if self.name() != variable:
+                self.error("Unknown variable in constraint")
+            self.expect_symbol(".")
+            key = self.name()
+            self.expect_keyword("IS")
+            self.expect_keyword("UNIQUE")
+            clauses.append(("constraint", label, key))
+
+        while self.peek()[0] is not None and not self.at_symbol(";"):
+            if self.at_keyword("UNWIND"):
+                self.position += 1
+                expression = self.expression()
+                self.expect_keyword("AS")
+                clauses.append(("unwind", expression, self.name()))
+            elif self.at_keyword("MATCH"):
+                self.position += 1
+                clauses.append(("match", self.patterns()))
+            elif self.at_keyword("CREATE"):
+                self.position += 1
+                clauses.append(("create", self.patterns()))
+            elif self.at_keyword("MERGE"):
+                self.position += 1
+                clauses.append(("merge", self.pattern()))
+            elif self.at_keyword("SET"):
+                self.position += 1
+                clauses.append(("set", self.items(self.set_item)))
+            elif self.at_keyword("REMOVE"):
+                self.position += 1
+                clauses.append(("remove", self.items(self.remove_item)))
+            elif self.at_keyword("DETACH") or self.at_keyword("DELETE"):
+                detach = self.at_keyword("DETACH")
+                if detach:
+                    self.position += 1
+                self.expect_keyword("DELETE")
+                clauses.append(("delete", detach, self.items(self.name)))
+            elif self.at_keyword("RETURN"):
+                self.position += 1
+                clauses.append(("return", self.items(self.return_item)))
+            else:
+                self.error("Unsupported clause starting with '{}'".format(self.peek()[2]))
+
+        if self.at_symbol(";"):
+            self.position += 1
+        if self.peek()[0] is not None:
+            self.error("Only one statement per query is supported")
+        return clauses
+
+    def items(self, item):
+        items = [item()]
+        while self.at_symbol(","):
+            self.position += 1
+            items.append(item())
+        return items
+
+    def set_item(self):
+        variable = self.name()
+        if self.at_symbol(":"):
+            return ("labels", variable, self.labels())
+        if self.at_symbol("."):
+            self.position += 1
+            key = self.name()
+            self.expect_symbol("=")
+            return ("property", variable, key, self.expression())
+        if self.at_symbol("+="):
+            self.position += 1
+            return ("add_properties", variable, self.expression())
+        self.expect_symbol("=")
+        return ("properties", variable, self.expression())
+
+    def remove_item(self):
+        variable = self.name()
+        if self.at_symbol(":"):
+            return ("labels", variable, self.labels())
+        self.expect_symbol(".")
+        return ("property", variable, self.name())
+
+    def return_item(self):
+        start = self.position
+        expression = self.expression()
+        if self.at_keyword("AS"):
+            self.position += 1
+            return (expression, self.name())
+        return (expression, "".join(token[2] for token in self.tokens[start:self.position]))
+
+    #
+    # Patterns
+    #
+    def patterns(self):
+        return self.items(self.pattern)
+
+    def pattern(self):
+        pattern = [self.node_pattern()]
+        while self.at_symbol("-"):
+            pattern.append(self.relationship_pattern())
+            pattern.append(self.node_pattern())
+        return pattern
+
+    def node_pattern(self):
+        self.expect_symbol("(")
+        variable = None
+        if self.peek()[0] == "word":
+            variable = self.name()
+        labels = self.labels() if self.at_symbol(":") else []
+        properties = self.map_items() if self.at_symbol("{") else []
+        self.expect_symbol(")")
+        return {"variable": variable, "labels": labels, "properties": properties}
+
+    def relationship_pattern(self):
+        self.expect_symbol("-")
+        self.expect_symbol("[")
+        variable = None
+        if self.peek()[0] == "word":
+            variable = self.name()
+        relationship_type = None
+        if self.at_symbol(":"):
+            self.position += 1
+            relationship_type = self.name()
+        properties = self.map_items() if self.at_symbol("{") else []
+        self.expect_symbol("]")
+        self.expect_symbol("->")
+        return {"variable": variable, "type": relationship_type, "properties": properties}
+
+    def labels(self):
+        labels = []
+        while self.at_symbol(":"):
+            self.position += 1
+            labels.append(self.name())
+        return labels
+
+    #
+    # Expressions
+    #
+    def map_items(self):
+        self.expect_symbol("{")
+        items = []
+        while not self.at_symbol("}"):
+            if items:
+                self.expect_symbol(",")
+            key = self.name()
+            self.expect_symbol(":")
+            items.append((key, self.expression()))
+        self.expect_symbol("}")
+        return items
+
+    def expression(self):
+        kind, value, text = self.peek()
+        if kind in ["string", "number"]:
+            self.position += 1
+            return ("literal", value)
+        if kind == "parameter":
+            self.position += 1
+            return ("parameter", value)
+        if self.at_symbol("["):
+            self.position += 1
+            items = []
+            while not self.at_symbol("]"):
+                if items:
+                    self.expect_symbol(",")
+                items.append(self.expression())
+            self.expect_symbol("]")
+            return ("list", items)
+        if self.at_symbol("{"):
+            return ("map", self.map_items())
+        if kind == "word":
+            if text.upper() in ["TRUE", "FALSE", "NULL"]:
+                self.position += 1
+                return ("literal", {"TRUE": True, "FALSE": False, "NULL": None}[text.upper()])
+            if self.at_symbol("(", 1):
+                return self.function()
+            self.position += 1
+            expression = ("variable", value)
+            while self.at_symbol("."):
+                self.position += 1
+                expression = ("property", expression, self.name())
+            return expression
+        self.error("Unsupported expression starting with '{}'".format(text))
+
+    def function(self):
+        function_name = self.name().lower()
+        self.expect_symbol("(")
+        if function_name == "count":
+            if self.at_symbol("*"):
+                self.position += 1
+                argument = None
+            else:
+                argument = self.expression()
+            self.expect_symbol(")")
+            return ("count", argument)
+        if function_name == "coalesce":
+            arguments = self.items(self.expression)
+            self.expect_symbol(")")
+            return ("coalesce", arguments)
+        self.error("Unsupported function '{}'".format(function_name))
+
+
 #########################
 # Costum Error Handling #
 #########################
@@ -654,10 +2555,44 @@ class DbConnectionError_Protocol(Exception):
         print("No Protocol specified")
         return super(DbConnectionError_Protocol, self).__init__()
 
+#
+# LoadInterruptedError should be raised if the database connection is lost during a load.
+# The database is not cleared, so the load can be resumed from the last checkpoint.
+#
+class LoadInterruptedError(Exception):
+    def __init__(self, checkpoint_file, error):
+        print("\n//#### ERROR ####\n//Lost the database connection: " + str(error))
+        print("//The database was not cleared. Rerun with the same domain models and the option --resume " +
+              "to continue from the last checkpoint stored in '" + str(checkpoint_file) + "'.")
+        sys.exit()
+
+#
+# CheckpointMismatchError should be raised if a load is resumed with other batch bounds than the checkpoint was written with.
+# The database is not touched, the load can be resumed with the --batch-memory of the checkpoint.
+#
+class CheckpointMismatchError(Exception):
+    def __init__(self, checkpoint_file, checkpoint):
+        print("\n//#### ERROR ####\n//Can not resume from the checkpoint stored in '" + str(checkpoint_file) +
+              "', it was written with other batch bounds.")
+        if checkpoint.get("row_batch_size") == DomainModelCreator.ROW_BATCH_SIZE and checkpoint.get("max_batch_bytes"):
+            print("//The database was not touched. Rerun with --resume and --batch-memory {!r} to continue the load.".format(
+                checkpoint["max_batch_bytes"] / 1024.0 / 1024))
+        else:
+            print("//The database was not touched. The checkpoint was written by another version of this script, " +
+                  "rerun without --resume to load the database from scratch.")
+        sys.exit()
+
 class EmptySubClassError(KeyError):
     def __init__(self):
         return super(EmptySubClassError, self).__init__()
 
+# Errors found by parse_domain_model, raised by name in the main process
+IMPORT_ERRORS = {
+    "NoListError": NoListError,
+    "NoClassesListError": NoClassesListError,
+    "UpperMostLevelError": UpperMostLevelError
+}
+
 
 #######################
 # Execution of import #
@@ -666,15 +2601,29 @@ class EmptySubClassError(KeyError):
 def main():
     global has_warning
     has_warning = False
+    mismatches = 0
 
     try:
         opts, args = getopt.getopt(sys.argv[1:],
                                    "hv",
-                                   ["db=", "help", "verbose", "vv", "vvv"])
+                                   ["db=", "help", "verbose", "vv", "vvv", "resume", "checkpoint=",
+                                    "batch-size=", "commit-latency=", "batch-memory=", "verify", "verify-checksums", "jobs=",
+                                    "migrate-from=", "output=", "dry-run", "profile-queries"])
         # h, help = show helpfile
         # v, verbose = Enable verbose mode
         # vv = Enable very verbose mode
         # db = requires databse connection to be stated
+        # resume = continue an interrupted load from the last checkpoint
+        # checkpoint = file storing the checkpoint of a load
+        # batch-size = bounds of the batch size, MIN:MAX
+        # commit-latency = commit latency the batch sizes are tuned to
+        # verify = compare the counts of the loaded graph with the domain models
+        # verify-checksums = compare checksums of the loaded graph with the domain models as well
+        # jobs = number of processes parsing the python dict files
+        # migrate-from = python dict files of the old domain models, writes a migration script instead of loading
+        # output = file the queries or the migration script are written to
+        # dry-run = load into an in-memory graph instead of a database
+        # profile-queries = run samples of each statement template with PROFILE and report their plans
 
     except getopt.GetoptError as err:
         print(err)
@@ -685,31 +2634,47 @@ def main():
     # Import information from dict files
     domain_models = domain_model_creator.import_data_files()
 
-    # Establish Database connection, clear database
-    if hasattr(domain_model_creator, "db_url") and hasattr(domain_model_creator, "db_pwd") and hasattr(domain_model_creator, "db_user"):
+    # Write migration script from the old domain models, no database needed
+    if domain_model_creator.migrate_from:
+        old_domain_models = domain_model_creator.import_data_files(domain_model_creator.migrate_from)
+        domain_model_creator.create_migration_script(old_domain_models, domain_models)
+        return
+
+    # Establish Database connection (or in-memory graph for dry runs), clear database
+    if domain_model_creator.opt_dry_run or (hasattr(domain_model_creator, "db_url") and 
+            hasattr(domain_model_creator, "db_pwd") and hasattr(domain_model_creator, "db_user")):
         try:
             # Set up db connection
+            # Only checkpoints need the hash, dry runs do not write them
+            if not domain_model_creator.opt_dry_run:
+                domain_model_creator.model_hash = domain_model_creator.hash_domain_models(domain_models)
             domain_model_creator.setup_db_connection()
             # Call creation scripts
-            domain_model_creator.create_nodes(domain_models)
-            domain_model_creator.create_relations_subclass(domain_models)
-            print 'sas'
-            domain_model_creator.create_relations_objectproperty(domain_models)
-            domain_model_creator.create_namespaces(domain_models)
-            domain_model_creator.create_property_nodes(domain_models)
-            domain_model_creator.create_req_property_relations(domain_models)
-            domain_model_creator.create_opt_property_relations(domain_models)
+            domain_model_creator.run_phases(domain_models)
+            if domain_model_creator.opt_verify:
+                mismatches = domain_model_creator.verify_load(domain_models)
+            if domain_model_creator.opt_dry_run:
+                domain_model_creator.print_graph_summary()
 
         except Exception as e:
-            if type(e) == neo4j.exceptions.AuthError:
+            if neo4j is not None and type(e) == neo4j.exceptions.AuthError:
                 print_warning("Could not establish a database connection. URL, password and/or username is inncorrect.")
                 sys.exit()
             else:
                 raise e
 
+    # No database stated: print queries, the database drivers are not imported
+    else:
+        if domain_model_creator.opt_verify:
+            print_info("Verification needs a database connection (--db) or a dry run (--dry-run). Skipping verification.")
+        domain_model_creator.write_script(domain_models)
+
     
     if has_warning == True and domain_model_creator.neo4j_connection != None:
-        domain_model_creator.execute_query("MATCH (n) DETACH DELETE n", "Clearing Database due to critical error".upper())
+        # Run directly, execute_query would only add it to a batch
+        domain_model_creator.neo4j_connection.run("MATCH (n) DETACH DELETE n")
+        print_info("Clearing Database due to critical error".upper())
+        domain_model_creator.remove_checkpoint()
         print("// Finished with a critical error during importing or parsing the files. \n" +
             "// The db was cleared, since some entities were missing some required information. \n" + 
             "// Plaese see displayed warnings for details. \n" +
@@ -720,14 +2685,118 @@ def main():
             "// Plaese see displayed warnings for details. \n" +
             "// Please fix these warnings before attempting to load the db. \n")
     else: 
+        if domain_model_creator.neo4j_connection != None:
+            domain_model_creator.remove_checkpoint()
+        if mismatches:
+            print_info(("FINISHED, BUT THE VERIFICATION FOUND {} MISMATCHES. " +
+                        "The loaded graph was kept, please see the displayed mismatches for details.").format(mismatches))
+            sys.exit(1)
         print_info("FINISHED SUCCESSFULLY")
 
+# Literals, lists of literals and variables of a query, replaced by query_template
+QUERY_LITERALS = re.compile(r"'(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\"|\b\d+(?:\.\d+)?\b")
+QUERY_LIST_LITERALS = re.compile(r"\[\s*\?(?:\s*,\s*\?)*\s*\]")
+QUERY_VARIABLES = re.compile(r"\(\s*\w+\s*(?=[:)])")
+
+# Node patterns looking up nodes by one or more labels and a property, which should be planned as index seek
+KEY_LOOKUP = re.compile(r"(MATCH|MERGE)[^;]*\(\s*\w*\s*(?::[`\w]+)+\s*\{", re.IGNORECASE)
+
+#
+# Statement template of a query: literals are replaced by '?' and node variables are removed,
+# so queries that only differ in their data share one template.
+# Queries without literals (parameterized queries) are their own template, only whitespace is normalized.
+#
+def query_template(query):
+    if not QUERY_LITERALS.search(query):
+        return " ".join(query.split())
+    template = QUERY_LITERALS.sub("?", query)
+    template = QUERY_LIST_LITERALS.sub("[?]", template)
+    template = QUERY_VARIABLES.sub("(", template)
+    return " ".join(template.split())
+
+#
+# Flattens a query plan into a list of (operator, db hits, rows), root operator first.
+# Plans can be dicts (bolt summary) or objects (neo4j driver, py2neo) with differently named fields.
+#
+def plan_operators(plan):
+    if isinstance(plan, dict):
+        operator = plan.get("operatorType", plan.get("operator_type", "?"))
+        arguments = plan.get("args", plan.get("arguments", {})) or {}
+        db_hits = plan.get("dbHits", plan.get("db_hits", arguments.get("DbHits", 0)))
+        rows = plan.get("rows", arguments.get("Rows", 0))
+        children = plan.get("children", [])
+    else:
+        operator = getattr(plan, "operator_type", "?")
+        arguments = getattr(plan, "arguments", None) or getattr(plan, "args", None) or {}
+        db_hits = getattr(plan, "db_hits", None)
+        if db_hits is None:
+            db_hits = arguments.get("DbHits", 0)
+        rows = getattr(plan, "rows", None)
+        if rows is None:
+            rows = arguments.get("Rows", 0)
+        children = getattr(plan, "children", [])
+
+    # Neo4j 4 appends the runtime to the operator, e.g. 'NodeByLabelScan@neo4j'
+    operators = [(str(operator).split("@")[0], db_hits or 0, rows or 0)]
+    for child in children or []:
+        operators.extend(plan_operators(child))
+    return operators
+
+#
+# Imports the database drivers. Called only when a database is used.
+#
+def import_database_drivers():
+    global py2neo, neo4j, CONNECTION_ERRORS
+    import py2neo
+    import neo4j
+    # urllib3 is used by py2neo for http:// URLs, its errors signal failed requests, not failed queries
+    import urllib3
+    CONNECTION_ERRORS = (neo4j.exceptions.ServiceUnavailable, neo4j.exceptions.SessionExpired,
+                         urllib3.exceptions.HTTPError, socket.error)
+
+#
+# Order-independent checksum over values (strings or tuples of strings).
+# Sums a 64 bit hash of each value, so duplicates are counted, unlike with xor.
+#
+def checksum(values):
+    total = 0
+    for value in values:
+        if type(value) is not tuple:
+            value = (value,)
+        parts = []
+        for part in value:
+            if part is None:
+                part = ""
+            parts.append(part.encode("utf-8") if isinstance(part, type(u"")) else str(part))
+        total = (total + int(hashlib.sha1(b"\x1f".join(parts)).hexdigest()[:16], 16)) % 2**64
+    return total
+
+#
+# Estimates the size (in bytes) of a parameter value sent to the database, in linear time.
+# Used to cap the memory taken up by the parameters of a batch, see --batch-memory.
+#
+def estimated_size(value):
+    if isinstance(value, basestring):
+        return len(value) + 2
+    if isinstance(value, dict):
+        return 2 + sum(len(key) + 4 + estimated_size(item) for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return 2 + sum(estimated_size(item) + 2 for item in value)
+    return 8
+
 #
 # Helper function for printing cypher compatible success info
 #
 def print_info(msg):
     print("\n//INFO: {} \n".format(msg))
 
+#
+# Helper function for printing cypher compatible verification mismatches
+# Unlike warnings, mismatches do not clear the database
+#
+def print_mismatch(msg):
+    print("\n//#### MISMATCH ####\n//{}\n".format(msg))
+
 #
 # Helper function for printing cyhper compatible warnings
 # Sets also warning flag for displaying master warning after script has finished